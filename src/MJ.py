@@ -1,11 +1,16 @@
 import sys
 import os
 import json
+import re
 import time
-import base64
+import uuid
+import heapq
+import random
+import hashlib
+import itertools
+import asyncio
 import threading
 import websocket
-import requests
 from datetime import datetime
 from PIL import Image
 import anthropic
@@ -15,31 +20,216 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QScrollArea, QMessageBox, QFrame, QTextEdit,
                            QSplitter, QListWidget, QFileDialog)
 from PyQt5.QtGui import QPixmap, QColor, QPainter
-from PyQt5.QtCore import Qt, QSize, pyqtSignal, QThread
+from PyQt5.QtCore import Qt, QSize, QTimer, pyqtSignal, QThread
+
+from core.command_cache import CommandCache
+from core.http_session import HttpTransport
+from core.job_scheduler import JobScheduler
+from core.download_pool import DownloadPool
+from utils.gateway_codec import GatewayDecoder
+from utils.image_encoding import ImageEncoder
+from core.event_filter import EventFilter
+from core.sequence_allocator import SequenceAllocator
+from core.job_journal import JobJournal
+from core.progress import ProgressCoalescer, parse_progress
+from core.heartbeat import Heartbeat, LatencyHistogram
+from core.dedup_index import DedupIndex
+from core.grid_splitter import GridSplitter
+from core.gateway_recorder import GatewayRecorder
+from core.event_bus import EventBus, LOG, STATUS
+from core.analysis_worker import AnalysisWorker, BatchAnalysisWorker
+from core.analysis_cache import AnalysisCache
+from core.token_usage import TokenUsage
+from core.prompt_classifier import PromptClassifier
+
+PROMPT_PATTERN = re.compile(r"\*\*(.+?)\*\*", re.DOTALL)
+
+class TokenBucket:
+    def __init__(self, max_requests, time_window):
+        """Bucket a token con refill continuo"""
+        self.capacity = max_requests
+        self.refill_rate = max_requests / time_window  # token al secondo
+        # Parte con un solo token: finché gli header non danno i valori reali
+        # il primo secondo resta entro max_requests, senza raffica iniziale
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        """Ricarica i token maturati dall'ultimo accesso"""
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.last_refill = now
+
+    def wait_time(self, now):
+        """Secondi da attendere prima che sia disponibile un token"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.refill_rate
 
 # Riutilizziamo RateLimiter da PROMPT.py
 class RateLimiter:
     def __init__(self):
-        """Inizializza il rate limiter con i limiti globali e per endpoint"""
+        """Inizializza il rate limiter con i limiti globali e per route"""
         self.global_limits = {
             "time_window": 1,  # 1 secondo
             "max_requests": 50  # massimo 50 richieste per secondo
         }
-        self.endpoint_limits = {
-            "imagine": {"time_window": 1, "max_requests": 5},
-            "upscale": {"time_window": 1, "max_requests": 5},
-            "variation": {"time_window": 1, "max_requests": 5},
+        # imagine, upscale e variation fanno tutti POST /interactions: per Discord è un solo bucket
+        self.endpoint_routes = {
+            "imagine": "interactions",
+            "upscale": "interactions",
+            "variation": "interactions",
         }
-        self.global_requests = []
-        self.endpoint_requests = {
-            "imagine": [],
-            "upscale": [],
-            "variation": []
+        self.route_limits = {
+            "interactions": {"time_window": 1, "max_requests": 5},
+        }
+        self.global_bucket = TokenBucket(**self.global_limits)
+        # Chiave: route statica, poi l'X-RateLimit-Bucket appreso dagli header
+        self.buckets = {
+            route: TokenBucket(**limits)
+            for route, limits in self.route_limits.items()
         }
         self.max_retries = 3
         self.base_retry_delay = 1
+        self.max_retry_delay = 30
+        self.safety_margin = 1  # token lasciati liberi per restare sotto il limite
+        self.lock = threading.Lock()
+        self.stats = {
+            "acquired": 0,
+            "rejected": 0,
+            "rate_limited": 0,
+            "global_rate_limited": 0,
+            "wait_time": 0.0
+        }
+
+    def _bucket(self, endpoint):
+        """Bucket condiviso da tutti gli endpoint sulla stessa route"""
+        return self.buckets.get(self.endpoint_routes.get(endpoint))
+
+    def _wait_time(self, endpoint, now):
+        """Attesa necessaria considerando bucket globale e della route"""
+        wait = self.global_bucket.wait_time(now)
+        bucket = self._bucket(endpoint)
+        if bucket:
+            wait = max(wait, bucket.wait_time(now))
+        return wait
+
+    def _consume(self, endpoint):
+        """Consuma un token dal bucket globale e da quello della route"""
+        self.global_bucket.tokens -= 1
+        bucket = self._bucket(endpoint)
+        if bucket:
+            bucket.tokens -= 1
+        self.stats["acquired"] += 1
+
+    def acquire(self, endpoint, timeout=None):
+        """Acquisizione bloccante con timeout opzionale; timeout=0 non attende"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self._wait_time(endpoint, now)
+                if wait <= 0:
+                    self._consume(endpoint)
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        self.stats["rejected"] += 1
+                        return False
+                    wait = min(wait, deadline - now)
+                self.stats["wait_time"] += wait
+            time.sleep(wait)
+
+    def update_from_headers(self, endpoint, headers):
+        """Aggiorna il bucket della route dagli header X-RateLimit-*"""
+        try:
+            if "X-RateLimit-Limit" not in headers:
+                return
 
-    # [Resto della classe RateLimiter rimane identico a PROMPT.py]
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers.get("X-RateLimit-Remaining", limit))
+            reset_after = float(headers.get("X-RateLimit-Reset-After", 0))
+            bucket_id = headers.get("X-RateLimit-Bucket")
+
+            with self.lock:
+                bucket = self._bucket(endpoint)
+                if not bucket:
+                    return
+
+                # Il bucket di Discord diventa la chiave: chi lo condivide vede gli stessi limiti
+                if bucket_id and self.endpoint_routes[endpoint] != bucket_id:
+                    route = self.endpoint_routes[endpoint]
+                    bucket = self.buckets.setdefault(bucket_id, self.buckets.pop(route))
+                    for name, current in self.endpoint_routes.items():
+                        if current == route:
+                            self.endpoint_routes[name] = bucket_id
+
+                now = time.monotonic()
+                bucket.refill(now)
+                bucket.capacity = max(1, limit - self.safety_margin)
+
+                # Prima richiesta della finestra: reset_after coincide con la finestra
+                if remaining == limit - 1 and reset_after > 0:
+                    bucket.refill_rate = bucket.capacity / reset_after
+
+                usable = remaining - self.safety_margin
+                bucket.tokens = min(bucket.tokens, max(0, usable))
+                if usable <= 0 and reset_after > 0:
+                    bucket.blocked_until = max(bucket.blocked_until, now + reset_after)
+
+        except (TypeError, ValueError):
+            pass
+
+    def handle_rate_limit(self, endpoint, response, attempt=0):
+        """Gestisce una risposta 429 e ritorna i secondi di attesa applicati"""
+        retry_after = None
+        is_global = response.headers.get("X-RateLimit-Global", "").lower() == "true"
+        try:
+            body = response.json()
+            retry_after = float(body.get("retry_after"))
+            is_global = is_global or bool(body.get("global"))
+        except Exception:
+            pass
+
+        if retry_after is None:
+            try:
+                retry_after = float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                retry_after = self.get_retry_delay(attempt)
+
+        delay = retry_after + random.uniform(0, self.base_retry_delay * 0.5)
+
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.global_bucket if is_global else (self._bucket(endpoint) or self.global_bucket)
+            bucket.tokens = 0
+            bucket.last_refill = now
+            bucket.blocked_until = max(bucket.blocked_until, now + delay)
+            self.stats["rate_limited"] += 1
+            if is_global:
+                self.stats["global_rate_limited"] += 1
+
+        return delay
+
+    def get_retry_delay(self, attempt):
+        """Backoff esponenziale con full jitter"""
+        return random.uniform(0, min(self.max_retry_delay, self.base_retry_delay * (2 ** attempt)))
+
+    def get_stats(self):
+        """Ritorna una copia dei contatori"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["tokens"] = {
+                bucket_id: round(bucket.tokens, 2)
+                for bucket_id, bucket in self.buckets.items()
+            }
+            stats["tokens"]["global"] = round(self.global_bucket.tokens, 2)
+            return stats
 
 class StatusIndicator(QWidget):
     def __init__(self, label, parent=None):
@@ -48,6 +238,7 @@ class StatusIndicator(QWidget):
         layout = QHBoxLayout(self)
         layout.setContentsMargins(5, 0, 5, 0)
         
+        self.label = label
         self.text_label = QLabel(label)
         layout.addWidget(self.text_label)
         
@@ -56,6 +247,10 @@ class StatusIndicator(QWidget):
         self.is_connected = False
         layout.addWidget(self.light)
 
+    def set_detail(self, detail):
+        """Mostra un dettaglio accanto all'etichetta (es. latenza)"""
+        self.text_label.setText(f"{self.label} ({detail})" if detail else self.label)
+
     # [Resto della classe StatusIndicator rimane identico a PROMPT.py]
 
 class DiscordClient:
@@ -64,10 +259,27 @@ class DiscordClient:
         self.app = app_reference
         self.ws = None
         self.session_id = None
+        self.resume_gateway_url = None
         self.heartbeat_interval = None
+        self.heartbeat_monitor = None
+        self.latency = LatencyHistogram()
         self.last_sequence = None
+        self.should_reconnect = True
+        self.reconnect_attempts = 0
+        self.base_reconnect_delay = 1
+        self.max_reconnect_delay = 60
+        self.last_close_code = None
+        # Close code dopo cui non ha senso riconnettersi (token, intents, shard)
+        self.fatal_close_codes = {4004, 4010, 4011, 4012, 4013, 4014}
+        # Close code che invalidano la sessione: serve un nuovo IDENTIFY
+        self.session_close_codes = {4007, 4009}
         self.rate_limiter = RateLimiter()
-        self.message_tracker = MessageTracker()
+        self.message_tracker = MessageTracker(JobJournal(app_reference))
+        pending_jobs = self.message_tracker.restore()
+        if pending_jobs:
+            self.app.log_message(f"[INFO] Restored {pending_jobs} pending jobs from journal")
+        self.command_cache = CommandCache(app_reference, self.fetch_application_commands)
+        self.scheduler = JobScheduler(app_reference, self)
 
         # Headers configurazione
         self.headers = {
@@ -79,31 +291,60 @@ class DiscordClient:
             "Cache-Control": "no-cache",
             "Pragma": "no-cache"
         }
-        self.base_url = "https://discord.com/api/v9"
+        # Sovrascrivibile per puntare a un servizio locale (utils/fake_discord.py)
+        self.base_url = app_reference.config.get("DISCORD_API_URL", "https://discord.com/api/v9")
+        self.http = HttpTransport(self.headers)
+        self.dedup_index = DedupIndex(app_reference)
+        self.download_pool = DownloadPool(
+            app_reference,
+            self.http,
+            self.determine_save_path,
+            self.handle_download_complete,
+            self.dedup_index
+        )
+        # Riaccoda subito i download rimasti a metà prima dell'ultima chiusura
+        self.download_pool.start()
+        self.grid_splitter = GridSplitter(
+            app_reference,
+            self.handle_quadrant,
+            app_reference.config.get("GRID_SPLIT_WORKERS")
+        )
+        self.decoder = GatewayDecoder()
+        self.progress = ProgressCoalescer()
+        self.sequence_allocator = SequenceAllocator(app_reference)
+        self.classifier = PromptClassifier(app_reference)
+        # Registrazione del gateway per utils/replay_harness.py (solo se configurata)
+        record_file = app_reference.config.get("GATEWAY_RECORD_FILE")
+        self.recorder = GatewayRecorder(app_reference, record_file) if record_file else None
         
         # Handlers per diversi tipi di eventi
         self.event_handlers = {
             "MESSAGE_CREATE": self.handle_message_create,
             "MESSAGE_UPDATE": self.handle_message_update,
-            "INTERACTION_CREATE": self.handle_interaction
+            "INTERACTION_CREATE": self.handle_interaction,
+            "INTERACTION_SUCCESS": self.handle_interaction
         }
+        self.event_filter = EventFilter(self.event_handlers)
 
     def connect(self):
         """Stabilisce la connessione WebSocket con Discord"""
         try:
-            response = requests.get(
-                f"{self.base_url}/gateway",
-                headers=self.headers,
-                timeout=10
-            )
-            if response.status_code != 200:
-                self.app.log_message(f"[ERROR] Failed to get gateway: {response.status_code}")
-                return False
-
-            gateway_url = response.json()["url"]
-            websocket.enableTrace(True)
+            if self.session_id and self.resume_gateway_url:
+                # Sessione ripristinabile: usa il gateway indicato nel READY
+                gateway_url = self.resume_gateway_url
+            else:
+                response = self.http.get(f"{self.base_url}/gateway")
+                if response.status_code != 200:
+                    self.app.log_message(f"[ERROR] Failed to get gateway: {response.status_code}")
+                    return False
+                gateway_url = response.json()["url"]
+
+            # Trace dei frame solo in debug: in produzione è solo rumore nel log
+            websocket.enableTrace(self.app.config.get("GATEWAY_TRACE", False))
+            self.decoder.reset()
+            self.event_filter.configure(self.app.config.get("CHANNEL_ID"))
             self.ws = websocket.WebSocketApp(
-                f"{gateway_url}/?v=9&encoding=json",
+                f"{gateway_url}/?{self.decoder.query_string()}",
                 on_message=self.on_message,
                 on_error=self.on_error,
                 on_close=self.on_close,
@@ -117,75 +358,175 @@ class DiscordClient:
             return False
 
     def start(self):
-        """Avvia il client Discord"""
-        if self.connect():
-            self.ws.run_forever()
+        """Avvia il client Discord e si riconnette finché non viene fermato"""
+        self.should_reconnect = True
+        while self.should_reconnect:
+            self.last_close_code = None
+            if self.connect():
+                try:
+                    self.ws.run_forever()
+                except Exception as e:
+                    self.app.log_message(f"[ERROR] WebSocket loop failed: {str(e)}")
 
-    def get_latest_command_version(self):
-        """Ottiene l'ultima versione dei comandi Midjourney"""
+            if not self.should_reconnect:
+                break
+
+            if self.last_close_code in self.fatal_close_codes:
+                self.app.log_message(f"[ERROR] Gateway closed with fatal code {self.last_close_code}")
+                break
+
+            if self.last_close_code in self.session_close_codes:
+                self.reset_session()
+
+            delay = self.get_reconnect_delay()
+            self.reconnect_attempts += 1
+            self.app.log_message(f"[INFO] Reconnecting in {delay:.1f}s (attempt {self.reconnect_attempts})")
+            time.sleep(delay)
+
+    def stop(self):
+        """Chiude la connessione senza riconnettersi e ferma i componenti in background"""
+        self.should_reconnect = False
+        if self.ws:
+            self.ws.close()
+        self.scheduler.stop()
+        self.download_pool.stop()
+        # Dopo lo scheduler: le ultime transizioni finiscono nel journal prima della chiusura
+        self.message_tracker.journal.close()
+        self.grid_splitter.shutdown()
+        if self.recorder:
+            self.recorder.close()
+        self.http.close()
+
+    def get_reconnect_delay(self):
+        """Backoff esponenziale con full jitter"""
+        cap = min(self.max_reconnect_delay, self.base_reconnect_delay * (2 ** self.reconnect_attempts))
+        return random.uniform(0, cap)
+
+    def reset_session(self):
+        """Dimentica la sessione corrente: il prossimo HELLO farà IDENTIFY"""
+        self.session_id = None
+        self.resume_gateway_url = None
+        self.last_sequence = None
+
+    def fetch_application_commands(self):
+        """Scarica i descrittori dei comandi Midjourney"""
         try:
-            response = requests.get(
-                f"{self.base_url}/applications/936929561302675456/commands",
-                headers=self.headers
+            response = self.http.get(
+                f"{self.base_url}/applications/936929561302675456/commands"
             )
             
             if response.status_code == 200:
-                for command in response.json():
-                    if command["name"] == "imagine":
-                        return command["version"]
+                return response.json()
             
-            self.app.log_message("[ERROR] Failed to fetch command version")
+            self.app.log_message(f"[ERROR] Failed to fetch commands: {response.status_code}")
             return None
             
         except Exception as e:
-            self.app.log_message(f"[ERROR] Failed to get command version: {str(e)}")
+            self.app.log_message(f"[ERROR] Failed to fetch commands: {str(e)}")
+            return None
+
+    def get_latest_command_version(self):
+        """Ottiene l'ultima versione dei comandi Midjourney"""
+        command = self.command_cache.get("imagine")
+        if not command:
+            self.app.log_message("[ERROR] Failed to fetch command version")
             return None
+        return command["version"]
+
+    def post_interaction(self, endpoint, payload):
+        """Invia un'interazione rispettando il rate limiter"""
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            self.rate_limiter.acquire(endpoint)
+            response = self.http.post(f"{self.base_url}/interactions", json=payload)
+            self.rate_limiter.update_from_headers(endpoint, response.headers)
+
+            if response.status_code != 429 or attempt == self.rate_limiter.max_retries:
+                return response
+
+            delay = self.rate_limiter.handle_rate_limit(endpoint, response, attempt)
+            self.app.log_message(f"[INFO] Rate limited on {endpoint}, retrying in {delay:.2f}s")
+
+        return response
+
+    @staticmethod
+    def is_stale_command(response):
+        """True se il 400 indica un descrittore del comando superato (versione o form non più validi)"""
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        if not isinstance(body, dict) or body.get("code") != 50035:
+            return False
 
-    def send_imagine_command(self, channel_id, guild_id, prompt):
+        # Gli errori del form sono annidati per campo: {"data": {"_errors": [{"code": ...}]}}
+        nodes = [body.get("errors")]
+        while nodes:
+            node = nodes.pop()
+            if not isinstance(node, dict):
+                continue
+            for error in node.get("_errors", []):
+                if "APPLICATION_COMMAND" in str(error.get("code", "")):
+                    return True
+            nodes.extend(value for key, value in node.items() if key != "_errors")
+        return False
+
+    @staticmethod
+    def generate_nonce():
+        """Nonce in formato snowflake per correlare interazione e risultato"""
+        return str((int(time.time() * 1000) - 1420070400000) << 22 | random.getrandbits(22))
+
+    def send_imagine_command(self, channel_id, guild_id, prompt, nonce=None):
         """Invia il comando imagine a Midjourney"""
         if not self.session_id:
             self.app.log_message("[ERROR] No session ID available")
             return False
 
         try:
-            version = self.get_latest_command_version()
-            if not version:
-                return False
-
-            payload = {
-                "type": 2,
-                "application_id": "936929561302675456",
-                "guild_id": str(guild_id),
-                "channel_id": str(channel_id),
-                "session_id": self.session_id,
-                "data": {
-                    "version": version,
-                    "id": "938956540159881230",
-                    "name": "imagine",
-                    "type": 1,
-                    "options": [{"type": 3, "name": "prompt", "value": prompt}],
-                    "attachments": []
+            for attempt in range(2):
+                command = self.command_cache.get("imagine")
+                if not command:
+                    self.app.log_message("[ERROR] Failed to fetch command version")
+                    return False
+
+                payload = {
+                    "type": 2,
+                    "application_id": "936929561302675456",
+                    "guild_id": str(guild_id),
+                    "channel_id": str(channel_id),
+                    "session_id": self.session_id,
+                    "nonce": nonce or self.generate_nonce(),
+                    "data": {
+                        "version": command["version"],
+                        "id": command["id"],
+                        "name": "imagine",
+                        "type": 1,
+                        "options": [{"type": 3, "name": "prompt", "value": prompt}],
+                        "attachments": []
+                    }
                 }
-            }
 
-            response = requests.post(
-                f"{self.base_url}/interactions",
-                headers=self.headers,
-                json=payload
-            )
+                response = self.post_interaction("imagine", payload)
 
-            if response.status_code == 204:
-                self.app.log_message("[INFO] Imagine command sent successfully")
-                return True
+                if response.status_code == 204:
+                    self.app.log_message("[INFO] Imagine command sent successfully")
+                    return True
+
+                # Versione rifiutata: invalida la cache e riprova una sola volta
+                if response.status_code == 400 and attempt == 0 and self.is_stale_command(response):
+                    self.app.log_message("[INFO] Imagine command version rejected, refreshing")
+                    self.command_cache.invalidate()
+                    continue
+
+                break
 
-            self.app.log_message(f"[ERROR] Failed to send imagine command: {response.status_code}")
+            self.app.log_message(f"[ERROR] Failed to send imagine command: {response.status_code} {response.text}")
             return False
 
         except Exception as e:
             self.app.log_message(f"[ERROR] Failed to send imagine command: {str(e)}")
             return False
 
-    def send_upscale_command(self, channel_id, guild_id, message_id, index, button_custom_id):
+    def send_upscale_command(self, channel_id, guild_id, message_id, index, button_custom_id, nonce=None):
         """Invia il comando di upscale"""
         if not self.session_id:
             self.app.log_message("[ERROR] No session ID available")
@@ -199,17 +540,14 @@ class DiscordClient:
                 "message_id": str(message_id),
                 "application_id": "936929561302675456",
                 "session_id": self.session_id,
+                "nonce": nonce or self.generate_nonce(),
                 "data": {
                     "component_type": 2,
                     "custom_id": button_custom_id
                 }
             }
 
-            response = requests.post(
-                f"{self.base_url}/interactions",
-                headers=self.headers,
-                json=payload
-            )
+            response = self.post_interaction("upscale", payload)
 
             if response.status_code == 204:
                 self.app.log_message(f"[INFO] Upscale {index} command sent successfully")
@@ -222,7 +560,7 @@ class DiscordClient:
             self.app.log_message(f"[ERROR] Failed to send upscale command: {str(e)}")
             return False
 
-    def send_variation_command(self, channel_id, guild_id, message_id, index):
+    def send_variation_command(self, channel_id, guild_id, message_id, index, nonce=None):
         """Invia il comando per generare una variazione"""
         if not self.session_id:
             self.app.log_message("[ERROR] No session ID available")
@@ -238,17 +576,14 @@ class DiscordClient:
                 "message_id": str(message_id),
                 "application_id": "936929561302675456",
                 "session_id": self.session_id,
+                "nonce": nonce or self.generate_nonce(),
                 "data": {
                     "component_type": 2,
                     "custom_id": button_custom_id
                 }
             }
 
-            response = requests.post(
-                f"{self.base_url}/interactions",
-                headers=self.headers,
-                json=payload
-            )
+            response = self.post_interaction("variation", payload)
 
             if response.status_code == 204:
                 self.app.log_message(f"[INFO] Variation {index} command sent successfully")
@@ -279,52 +614,190 @@ class DiscordClient:
                             index = component["custom_id"].split("::")[-2]
                             buttons_data[f"{action_type}_{index}"] = component["custom_id"]
 
+            content = message_data.get("content", "")
+            classification = self.classifier.classify(content)
+            sref = self.extract_sref(content, classification)
+            category = self.determine_category(content, classification)
+
+            # Contesto serializzabile: sopravvive nella coda dei tentativi tra sessioni
+            context = {
+                "content": content,
+                "sref": sref,
+                "category": category,
+                "message_id": message_id,
+                "buttons_data": buttons_data
+            }
+
             for attachment in message_data["attachments"]:
                 if not any(attachment["filename"].lower().endswith(ext) 
                           for ext in ['.png', '.jpg', '.jpeg']):
                     continue
 
-                response = requests.get(attachment["url"])
-                if response.status_code == 200:
-                    # Determina il percorso di salvataggio
-                    save_path = self.determine_save_path(message_data)
-                    
-                    with open(save_path, 'wb') as f:
-                        f.write(response.content)
-
-                    # Emetti il segnale per la nuova immagine
-                    self.app.newImageReceived.emit(
-                        save_path,
-                        self.extract_sref(message_data.get("content", "")),
-                        self.determine_category(message_data.get("content", "")),
-                        None,  # subcategory
-                        message_id,
-                        buttons_data
-                    )
+                # Allegato già salvato o in download: nessun byte da scaricare
+                key = self.dedup_index.attachment_key(attachment)
+                if not self.dedup_index.claim(key):
+                    continue
+
+                # Download nel pool: il thread WebSocket non attende la rete
+                self.download_pool.submit(
+                    attachment["url"],
+                    context,
+                    key,
+                    size=attachment.get("size")
+                )
 
         except Exception as e:
             self.app.log_message(f"[ERROR] Failed to handle Midjourney message: {str(e)}")
 
+    def handle_download_complete(self, save_path, context):
+        """Emette il segnale solo a file completo e verificato"""
+        self.app.newImageReceived.emit(
+            save_path,
+            context["sref"],
+            context["category"],
+            None,  # subcategory
+            context["message_id"],
+            context["buttons_data"]
+        )
+
+        # Griglia 2x2 di /imagine: quadranti ritagliati nel pool di processi
+        if self.app.config.get("SPLIT_GRIDS", False) and GridSplitter.is_grid(context["buttons_data"]):
+            self.grid_splitter.submit(save_path, context)
+
+    def handle_quadrant(self, quadrant_path, index, context):
+        """Registra un quadrante con i bottoni U/V che gli corrispondono"""
+        buttons_data = {
+            key: custom_id for key, custom_id in context["buttons_data"].items()
+            if key in (f"upscale_{index}", f"variation_{index}")
+        }
+        buttons_data["quadrant"] = index
+        self.app.newImageReceived.emit(
+            quadrant_path,
+            context["sref"],
+            context["category"],
+            None,  # subcategory
+            context["message_id"],  # messaggio della griglia padre
+            buttons_data
+        )
+
+    def handle_message_create(self, message_data):
+        """Gestisce i nuovi messaggi del canale"""
+        if message_data.get("author", {}).get("id") != "936929561302675456":
+            return
+
+        # Un risultato con allegati libera lo slot del job corrispondente
+        if message_data.get("attachments"):
+            job = self.scheduler.on_result(message_data)
+            if job:
+                self.progress.push(job.nonce, {
+                    "progress": 100,
+                    "preview_url": None,
+                    "message_id": message_data.get("id"),
+                    "label": job.params.get("prompt")
+                })
+
+        self.handle_midjourney_message(message_data)
+
+    def handle_message_update(self, message_data):
+        """Aggiorna l'avanzamento dei job dai MESSAGE_UPDATE di Midjourney"""
+        progress, preview_url = parse_progress(message_data)
+        if progress is None:
+            return
+
+        record = self.message_tracker.update_progress(message_data, progress, preview_url)
+        job_key = record["record_id"] if record else message_data.get("id")
+        prompt = record["data"].get("prompt") if record else None
+        self.progress.push(job_key, {
+            "progress": progress,
+            "preview_url": preview_url,
+            "message_id": message_data.get("id"),
+            "label": prompt or MessageTracker.extract_prompt(message_data.get("content", ""))
+        })
+
+    def handle_interaction(self, interaction_data):
+        """Collega il nonce di un'interazione inviata al suo id Discord"""
+        nonce = interaction_data.get("nonce")
+        if nonce:
+            self.message_tracker.link_interaction(nonce, interaction_data.get("id"))
+
     def on_message(self, ws, message):
         """Gestisce i messaggi WebSocket"""
         try:
-            data = json.loads(message)
+            raw = self.decoder.inflate(message)
+            if raw is None:
+                return
+
+            if self.recorder:
+                self.recorder.record(raw)
+
+            # Scarta i dispatch non pertinenti senza parsing completo
+            dropped = self.event_filter.inspect(raw)
+            if dropped:
+                self.last_sequence = dropped[1]
+                return
+
+            data = self.decoder.loads(raw)
             
             if data["op"] == 10:  # Hello
                 self.heartbeat_interval = data["d"]["heartbeat_interval"]
-                threading.Thread(target=self.heartbeat, daemon=True).start()
-                self.send_identify()
+                if self.heartbeat_monitor:
+                    self.heartbeat_monitor.stop()
+                self.heartbeat_monitor = Heartbeat(
+                    self.app, ws, self.heartbeat_interval,
+                    lambda: self.last_sequence, self.latency
+                )
+                self.heartbeat_monitor.start()
+                if self.session_id and self.last_sequence is not None:
+                    self.send_resume()
+                else:
+                    self.send_identify()
+
+            elif data["op"] == 11:  # Heartbeat ACK
+                if self.heartbeat_monitor:
+                    self.heartbeat_monitor.on_ack()
+
+            elif data["op"] == 1:  # Heartbeat richiesto dal gateway
+                if self.heartbeat_monitor:
+                    self.heartbeat_monitor.beat()
+
+            elif data["op"] == 7:  # Reconnect
+                self.app.log_message("[INFO] Gateway requested reconnect")
+                ws.close()
+
+            elif data["op"] == 9:  # Invalid Session
+                if data.get("d"):
+                    # Sessione ancora ripristinabile: riconnessione con RESUME
+                    ws.close()
+                else:
+                    self.app.log_message("[INFO] Session invalidated, identifying again")
+                    self.scheduler.set_session_ready(False)
+                    self.reset_session()
+                    threading.Timer(random.uniform(1, 5), self.send_identify).start()
                 
             elif data["op"] == 0:  # Dispatch
-                self.last_sequence = data["s"]
+                if data.get("s") is not None:
+                    self.last_sequence = data["s"]
                 
                 if data["t"] == "READY":
                     self.session_id = data["d"]["session_id"]
-                    self.app.discord_status.set_status(True)
+                    self.resume_gateway_url = data["d"].get("resume_gateway_url")
+                    self.reconnect_attempts = 0
+                    self.command_cache.prefetch()
+                    self.scheduler.start()
+                    self.scheduler.set_session_ready(True)
+                    self.app.event_bus.post(STATUS, ("discord", True))
                     self.app.log_message("[INFO] Discord client ready")
+
+                elif data["t"] == "RESUMED":
+                    # Gli eventi persi sono già stati rinviati prima di RESUMED
+                    self.reconnect_attempts = 0
+                    self.scheduler.set_session_ready(True)
+                    self.app.event_bus.post(STATUS, ("discord", True))
+                    self.app.log_message("[INFO] Discord session resumed")
                     
                 elif data["t"] in self.event_handlers:
-                    self.event_handlers[data["t"]](data["d"])
+                    if self.event_filter.accept(data["t"], data["d"]):
+                        self.event_handlers[data["t"]](data["d"])
                     
         except Exception as e:
             self.app.log_message(f"[ERROR] WebSocket message processing failed: {str(e)}")
@@ -332,17 +805,22 @@ class DiscordClient:
     def on_error(self, ws, error):
         """Gestisce gli errori WebSocket"""
         self.app.log_message(f"[ERROR] WebSocket error: {str(error)}")
-        self.app.discord_status.set_status(False)
+        self.app.event_bus.post(STATUS, ("discord", False))
 
     def on_close(self, ws, close_status_code, close_msg):
         """Gestisce la chiusura della connessione WebSocket"""
-        self.app.log_message(f"[INFO] WebSocket closed: {close_msg}")
-        self.app.discord_status.set_status(False)
+        self.last_close_code = close_status_code
+        # Nessun dispatch finché la sessione non torna READY/RESUMED
+        self.scheduler.set_session_ready(False)
+        if self.heartbeat_monitor:
+            self.heartbeat_monitor.stop()
+        self.app.log_message(f"[INFO] WebSocket closed ({close_status_code}): {close_msg}")
+        self.app.event_bus.post(STATUS, ("discord", False))
 
     def on_open(self, ws):
         """Gestisce l'apertura della connessione WebSocket"""
         self.app.log_message("[INFO] WebSocket connection opened")
-        self.app.discord_status.set_status(True)
+        self.app.event_bus.post(STATUS, ("discord", True))
 
     def send_identify(self):
         """Invia il payload di identificazione"""
@@ -369,45 +847,44 @@ class DiscordClient:
         except Exception as e:
             self.app.log_message(f"[ERROR] Failed to send identify payload: {str(e)}")
 
-    def heartbeat(self):
-        """Mantiene viva la connessione WebSocket"""
-        while self.ws and self.ws.sock and self.ws.sock.connected:
-            if self.heartbeat_interval:
-                try:
-                    payload = {"op": 1, "d": self.last_sequence}
-                    self.ws.send(json.dumps(payload))
-                    time.sleep(self.heartbeat_interval / 1000)
-                except Exception as e:
-                    self.app.log_message(f"[ERROR] Heartbeat failed: {str(e)}")
-                    break
-    def extract_sref(self, content):
+    def send_resume(self):
+        """Invia il payload di RESUME per riprendere la sessione"""
+        try:
+            resume_payload = {
+                "op": 6,
+                "d": {
+                    "token": self.token,
+                    "session_id": self.session_id,
+                    "seq": self.last_sequence
+                }
+            }
+            self.ws.send(json.dumps(resume_payload))
+            self.app.log_message(f"[INFO] Resuming session from sequence {self.last_sequence}")
+
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to send resume payload: {str(e)}")
+
+    def get_latency(self):
+        """Statistiche di latenza heartbeat in millisecondi, o None"""
+        return self.latency.summary()
+
+    def extract_sref(self, content, classification=None):
         """Estrae il sref dal contenuto del messaggio"""
         try:
-            sref_match = re.search(r'--sref\s+(\d+)', content)
-            return sref_match.group(1) if sref_match else None
+            classification = classification or self.classifier.classify(content)
+            sref = classification["parameters"].get("sref")
+            # Solo sref numerici: il valore diventa nome di cartella
+            return sref if sref and sref.isdigit() else None
         except Exception as e:
             self.app.log_message(f"[ERROR] Failed to extract sref: {str(e)}")
             return None
 
-    def determine_category(self, content):
+    def determine_category(self, content, classification=None):
         """Determina la categoria dal contenuto"""
         try:
-            # Mappa delle categorie comuni
-            categories = {
-                'Product_Photography': ['product', 'commercial'],
-                'Still_Life': ['still life', 'arrangement'],
-                'Interior_Photography': ['interior', 'room'],
-                'Landscape': ['landscape', 'scenic'],
-                'Architecture': ['building', 'architecture'],
-                'Fine_Art': ['fine art', 'artistic']
-            }
-            
-            content_lower = content.lower()
-            for category, keywords in categories.items():
-                if any(keyword in content_lower for keyword in keywords):
-                    return category
-                    
-            return None
+            classification = classification or self.classifier.classify(content)
+            categories = classification["categories"]
+            return categories[0][0] if categories else None
             
         except Exception as e:
             self.app.log_message(f"[ERROR] Failed to determine category: {str(e)}")
@@ -422,21 +899,11 @@ class DiscordClient:
             if sref:
                 # Percorso per immagini con sref
                 base_path = os.path.join(self.app.analysis_dir, f"sref_{sref}")
-                os.makedirs(base_path, exist_ok=True)
-                
-                existing = glob.glob(os.path.join(base_path, f"sref_{sref}_*.png"))
-                number = len(existing) + 1
-                
-                return os.path.join(base_path, f"sref_{sref}_{number:03d}.png")
+                return self.sequence_allocator.allocate(base_path, f"sref_{sref}_")
             else:
                 # Percorso per immagini base
                 base_path = os.path.join(self.app.output_dir, "00_BASE")
-                os.makedirs(base_path, exist_ok=True)
-                
-                existing = glob.glob(os.path.join(base_path, "img_*.png"))
-                number = len(existing) + 1
-                
-                return os.path.join(base_path, f"img_{number:03d}.png")
+                return self.sequence_allocator.allocate(base_path, "img_")
                 
         except Exception as e:
             self.app.log_message(f"[ERROR] Failed to determine save path: {str(e)}")
@@ -450,6 +917,11 @@ class ClaudeAnalyzer:
         self.base_output_dir = os.path.join(self.app.base_dir, "midjourney_output")
         self.analysis_queue = []
         self.processing = False
+        self.model = "claude-3-sonnet-20240229"
+        self.max_tokens = 1500
+        self.cache = AnalysisCache(app_reference)
+        self.encoder = ImageEncoder(app_reference)
+        self.usage = TokenUsage(app_reference)
 
     def analyze_image(self, image_path):
         try:
@@ -457,18 +929,27 @@ class ClaudeAnalyzer:
                 self.app.log_message(f"[ERROR] Image file not found: {image_path}")
                 return None
 
-            # Codifica l'immagine in base64
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-
             # Preparazione del prompt per Claude
             analysis_prompt = """[Prompt da PROMPT.py]"""  # Inserire il prompt completo
 
+            # Stessa immagine con stesse impostazioni: nessuna chiamata API
+            cache_key = self.cache.key(image_path, AnalysisCache.settings_hash(
+                prompt=analysis_prompt,
+                model=self.model,
+                max_tokens=self.max_tokens
+            ))
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.app.log_message(f"[INFO] Analysis cache hit: {os.path.basename(image_path)}")
+                return cached
+
+            # Ridimensiona, ricodifica e codifica l'immagine in base64
+            media_type, base64_image = self.encoder.encode(image_path)
+
             try:
                 response = self.client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=1500,
-                    temperature=0.7,
+                    model=self.model,
+                    max_tokens=self.max_tokens,
                     messages=[
                         {
                             "role": "user",
@@ -481,7 +962,7 @@ class ClaudeAnalyzer:
                                     "type": "image",
                                     "source": {
                                         "type": "base64",
-                                        "media_type": "image/png",
+                                        "media_type": media_type,
                                         "data": base64_image
                                     }
                                 }
@@ -490,8 +971,12 @@ class ClaudeAnalyzer:
                     ]
                 )
 
+                self.usage.record_usage(image_path, response.usage)
+
                 # Processa e salva l'analisi
                 analysis_result = self.process_claude_response(response, image_path)
+                if analysis_result is not None:
+                    self.cache.put(cache_key, analysis_result)
                 return analysis_result
 
             except Exception as e:
@@ -718,34 +1203,11 @@ class ImageGallery(QScrollArea):
                 btn.setEnabled(enable_buttons)
 
     def handle_upscale(self, index):
-        if len(self.parent_app.image_manager.selected_images) != 1:
-            return
-            
-        image_path = next(iter(self.parent_app.image_manager.selected_images))
-        message_id = self.parent_app.image_manager.image_tracking.get(image_path, {}).get('message_id')
-        
-        if message_id:
-            self.parent_app.discord_client.send_upscale_command(
-                self.parent_app.config["CHANNEL_ID"],
-                self.parent_app.config["GUILD_ID"],
-                message_id,
-                index
-            )
+        # Stesso percorso dei bottoni principali: passa dallo scheduler
+        self.parent_app.handle_upscale(index)
 
     def handle_variation(self, index):
-        if len(self.parent_app.image_manager.selected_images) != 1:
-            return
-            
-        image_path = next(iter(self.parent_app.image_manager.selected_images))
-        message_id = self.parent_app.image_manager.image_tracking.get(image_path, {}).get('message_id')
-        
-        if message_id:
-            self.parent_app.discord_client.send_variation_command(
-                self.parent_app.config["CHANNEL_ID"],
-                self.parent_app.config["GUILD_ID"],
-                message_id,
-                index
-            )
+        self.parent_app.handle_variation(index)
 
     def open_editor(self, image_path):
         try:
@@ -855,6 +1317,16 @@ class ClaudeAnalysisManager:
         self.analysis_queue = []
         self.is_processing = False
         self.current_analysis = None
+        self.model = "claude-3-sonnet-20240229"
+        self.max_tokens = 2000
+        self.cache = AnalysisCache(app_reference)
+        self.encoder = ImageEncoder(app_reference)
+        # Message Batches in corso, persistiti per riprendere dopo un riavvio
+        self.batch_file = os.path.join(app_reference.system_dir, "analysis_batches.json")
+        self.batch_max_requests = 1000
+        self.batch_max_bytes = 100 * 1024 * 1024  # ben sotto il limite di 256 MB per batch
+        self.batches = self.load_batches()
+        self.usage = TokenUsage(app_reference)
         self.prompt_template = """
 You are an expert in interpreting complex images.
 Your main role is to give a real subject and surrounding environment to the figures present in the analyzed image.
@@ -920,46 +1392,190 @@ PROMPT 2:
 [Creative variation]
 ---"""
 
-    async def analyze_image(self, image_path):
-        """Analizza un'immagine usando Claude"""
+    def cache_key(self, image_path):
+        """Chiave di cache: contenuto dell'immagine + prompt, modello e parametri"""
+        return self.cache.key(image_path, AnalysisCache.settings_hash(
+            prompt=self.prompt_template,
+            model=self.model,
+            max_tokens=self.max_tokens
+        ))
+
+    async def cached_analysis(self, image_path):
+        """Ritorna (chiave, analisi in cache o None) senza chiamare l'API"""
         try:
-            # Converti immagine in base64
-            with open(image_path, "rb") as img_file:
-                image_data = base64.b64encode(img_file.read()).decode('utf-8')
-
-            response = await self.app.claude_client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=2000,
-                temperature=0.7,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": self.prompt_template
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": image_data
-                                }
-                            }
-                        ]
-                    }
-                ]
-            )
+            cache_key = await asyncio.to_thread(self.cache_key, image_path)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to hash image for cache: {str(e)}")
+            return None, None
+
+        analysis_result = self.cache.get(cache_key)
+        if analysis_result is not None:
+            self.app.log_message(f"[INFO] Analysis cache hit: {os.path.basename(image_path)}")
+            # Copia di un'immagine già analizzata: manca solo il file di testo
+            if not os.path.exists(f"{os.path.splitext(image_path)[0]}_analysis.txt"):
+                self.save_analysis(image_path, analysis_result)
+        return cache_key, analysis_result
+
+    async def analyze_image(self, image_path, client=None, cache_key=None):
+        """Analizza un'immagine usando Claude (client async del loop chiamante)"""
+        try:
+            if cache_key is None:
+                cache_key, analysis_result = await self.cached_analysis(image_path)
+                if analysis_result is not None:
+                    return analysis_result
+
+            # Ridimensionamento e base64 in un thread: il loop continua a servire le altre richieste
+            media_type, image_data = await asyncio.to_thread(self.encoder.encode, image_path)
+
+            client = client or self.app.claude_client
+            response = await client.messages.create(**self.build_request(media_type, image_data))
+            self.usage.record_usage(image_path, response.usage)
 
             analysis_result = self.parse_response(response)
             self.save_analysis(image_path, analysis_result)
+            if analysis_result and cache_key:
+                self.cache.put(cache_key, analysis_result)
             return analysis_result
 
         except Exception as e:
             self.app.log_message(f"[ERROR] Analysis failed: {str(e)}")
             return None
 
+    def build_request(self, media_type, image_data):
+        """Parametri della richiesta, condivisi da analisi singola e Message Batches"""
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": self.prompt_template
+                        },
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": image_data
+                            }
+                        }
+                    ]
+                }
+            ]
+        }
+
+    def load_batches(self):
+        """Batch inviati e non ancora scaricati: {batch_id: {images, cache_keys, created}}"""
+        try:
+            if os.path.exists(self.batch_file):
+                with open(self.batch_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to load analysis batches: {str(e)}")
+        return {}
+
+    def save_batches(self):
+        """Salva lo stato dei batch in modo atomico"""
+        try:
+            temp_file = f"{self.batch_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.batches, f, indent=2)
+            os.replace(temp_file, self.batch_file)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to save analysis batches: {str(e)}")
+
+    def submit_batches(self, client, image_paths):
+        """Invia come Message Batches le immagini non in cache; ritorna {percorso: analisi} dalla cache"""
+        cached = {}
+        pending = {path for batch in self.batches.values() for path in batch["images"].values()}
+        batch_requests, images, cache_keys = [], {}, {}
+        request_bytes = 0
+
+        for image_path in image_paths:
+            if image_path in pending:
+                continue
+            try:
+                cache_key = self.cache_key(image_path)
+                analysis_result = self.cache.get(cache_key)
+                if analysis_result is not None:
+                    cached[image_path] = analysis_result
+                    continue
+
+                media_type, image_data = self.encoder.encode(image_path)
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Failed to prepare {os.path.basename(image_path)}: {str(e)}")
+                continue
+
+            # custom_id: massimo 64 caratteri alfanumerici, univoco nel batch
+            custom_id = f"img-{len(batch_requests)}"
+            batch_requests.append({"custom_id": custom_id, "params": self.build_request(media_type, image_data)})
+            images[custom_id] = image_path
+            cache_keys[custom_id] = cache_key
+            request_bytes += len(image_data)
+
+            if len(batch_requests) >= self.batch_max_requests or request_bytes >= self.batch_max_bytes:
+                self.create_batch(client, batch_requests, images, cache_keys)
+                batch_requests, images, cache_keys = [], {}, {}
+                request_bytes = 0
+
+        if batch_requests:
+            self.create_batch(client, batch_requests, images, cache_keys)
+        return cached
+
+    def create_batch(self, client, batch_requests, images, cache_keys):
+        """Crea un Message Batch e lo registra subito su disco"""
+        batch = client.messages.batches.create(requests=batch_requests)
+        self.batches[batch.id] = {
+            "images": images,
+            "cache_keys": cache_keys,
+            "created": datetime.now().isoformat()
+        }
+        self.save_batches()
+        self.app.log_message(f"[INFO] Submitted analysis batch {batch.id} with {len(batch_requests)} images")
+
+    def poll_batches(self, client):
+        """Scarica i batch conclusi; ritorna [(percorso, analisi o None se fallita)]"""
+        finished = []
+        for batch_id, batch in list(self.batches.items()):
+            status = client.messages.batches.retrieve(batch_id)
+            if status.processing_status != "ended":
+                continue
+
+            remaining = dict(batch["images"])
+            for entry in client.messages.batches.results(batch_id):
+                image_path = remaining.pop(entry.custom_id, None)
+                if image_path is None:
+                    continue
+
+                if entry.result.type == "succeeded":
+                    self.usage.record_usage(image_path, entry.result.message.usage)
+                    analysis_result = self.parse_response(entry.result.message)
+                    if analysis_result:
+                        self.save_analysis(image_path, analysis_result)
+                        self.cache.put(batch["cache_keys"][entry.custom_id], analysis_result)
+                    finished.append((image_path, analysis_result))
+                else:
+                    # errored / canceled / expired: le riuscite sono in cache, un nuovo invio rifà solo queste
+                    self.app.log_message(
+                        f"[ERROR] Batch analysis {entry.result.type} for {os.path.basename(image_path)}"
+                    )
+                    finished.append((image_path, None))
+
+            for image_path in remaining.values():
+                self.app.log_message(f"[ERROR] No batch result for {os.path.basename(image_path)}")
+                finished.append((image_path, None))
+
+            del self.batches[batch_id]
+            self.save_batches()
+            self.app.log_message(
+                f"[INFO] Analysis batch {batch_id} ended: {status.request_counts.succeeded} succeeded, "
+                f"{status.request_counts.errored + status.request_counts.expired + status.request_counts.canceled} failed"
+            )
+        return finished
+
     def parse_response(self, response):
         """Analizza la risposta di Claude e la struttura"""
         try:
@@ -1027,6 +1643,14 @@ class MidjourneyStudioApp(QMainWindow):
         self.setWindowTitle("Midjourney Studio")
         self.setGeometry(100, 100, 1400, 800)
 
+        # Bus eventi: i thread di rete e i worker non toccano mai i widget
+        self.event_bus = EventBus()
+        self.event_bus.subscribe(LOG, self.append_log_messages)
+        self.event_bus.subscribe(STATUS, self.apply_status_updates)
+        self.bus_timer = QTimer()
+        self.bus_timer.timeout.connect(self.event_bus.drain)
+        self.bus_timer.start(50)
+
         # Inizializzazione base paths
         self.base_dir = "D:\\AI_Art_Studio"
         self.output_dir = os.path.join(self.base_dir, "midjourney_output")
@@ -1060,11 +1684,33 @@ class MidjourneyStudioApp(QMainWindow):
         # Carica cartelle iniziali
         self.load_initial_folders()
 
+        # Batch di analisi inviati prima dell'ultima chiusura
+        QTimer.singleShot(0, self.resume_analysis_batches)
+
         # Timer per aggiornamento interfaccia
         self.update_timer = QTimer()
         self.update_timer.timeout.connect(self.update_interface_states)
         self.update_timer.start(1000)  # Aggiorna ogni secondo
 
+        # Timer per l'avanzamento dei job: al massimo un refresh per job per frame
+        self.job_progress = {}
+        self.progress_timer = QTimer()
+        self.progress_timer.timeout.connect(self.flush_job_progress)
+        self.progress_timer.start(100)
+
+    def closeEvent(self, event):
+        """Alla chiusura ferma client e worker e scrive su disco i journal"""
+        try:
+            if self.is_analysis_running():
+                self.analysis_worker.cancel()
+                self.analysis_worker.wait()
+            discord_client = getattr(self, "discord_client", None)
+            if discord_client:
+                discord_client.stop()
+        except Exception as e:
+            self.log_message(f"[ERROR] Shutdown failed: {str(e)}")
+        super().closeEvent(event)
+
     def init_ui(self):
         """Inizializza l'interfaccia utente"""
         central_widget = QWidget()
@@ -1129,9 +1775,19 @@ class MidjourneyStudioApp(QMainWindow):
         self.analyze_btn.clicked.connect(self.analyze_selected_images)
         self.analyze_btn.setEnabled(False)
         
+        self.batch_analyze_btn = QPushButton("Batch Analyze Folder")
+        self.batch_analyze_btn.clicked.connect(self.analyze_folder_batch)
+        self.batch_analyze_btn.setEnabled(False)
+        
+        self.stop_analysis_btn = QPushButton("Stop Analysis")
+        self.stop_analysis_btn.clicked.connect(self.stop_analysis)
+        self.stop_analysis_btn.setEnabled(False)
+        
         action_layout.addWidget(self.prompt_btn)
         action_layout.addWidget(self.card_btn)
         action_layout.addWidget(self.analyze_btn)
+        action_layout.addWidget(self.batch_analyze_btn)
+        action_layout.addWidget(self.stop_analysis_btn)
         left_layout.addLayout(action_layout)
         
         main_splitter.addWidget(left_panel)
@@ -1378,30 +2034,6 @@ class MidjourneyStudioApp(QMainWindow):
         except Exception as e:
             self.log_message(f"[ERROR] Failed to refresh folder list: {str(e)}")
 
-    def analyze_selected_images(self):
-        """Analizza le immagini selezionate"""
-        if not hasattr(self, 'claude_manager'):
-            self.claude_manager = ClaudeAnalysisManager(self)
-            
-        selected_images = self.image_manager.selected_images
-        if not selected_images:
-            QMessageBox.warning(self, "Warning", "No images selected for analysis")
-            return
-            
-        try:
-            for image_path in selected_images:
-                asyncio.run(self.claude_manager.analyze_image(image_path))
-                
-            # Aggiorna la visualizzazione
-            if hasattr(self, 'current_folder'):
-                self.gallery.load_folder(self.current_folder)
-                
-            QMessageBox.information(self, "Success", "Analysis completed")
-            
-        except Exception as e:
-            self.log_message(f"[ERROR] Analysis failed: {str(e)}")
-            QMessageBox.warning(self, "Error", str(e))
-
     def update_interface_states(self):
         """Aggiorna lo stato dell'interfaccia in base alle selezioni"""
         selected_count = len(self.image_manager.selected_images)
@@ -1412,10 +2044,32 @@ class MidjourneyStudioApp(QMainWindow):
                 btn.setEnabled(selected_count == 1)
         
         # Abilita/disabilita altri controlli
-        self.analyze_btn.setEnabled(selected_count > 0)
+        # Un'analisi alla volta: i bottoni restano disabilitati finché il worker gira
+        analysis_running = self.is_analysis_running()
+        self.analyze_btn.setEnabled(selected_count > 0 and not analysis_running)
         self.prompt_btn.setEnabled(hasattr(self, 'current_folder'))
+        self.batch_analyze_btn.setEnabled(hasattr(self, 'current_folder') and not analysis_running)
+        self.stop_analysis_btn.setEnabled(analysis_running)
         self.card_btn.setEnabled(selected_count > 0 and selected_count <= 5)
 
+        # Latenza del gateway accanto all'indicatore Discord
+        discord_client = getattr(self, "discord_client", None)
+        latency = discord_client.get_latency() if discord_client else None
+        self.discord_status.set_detail(
+            f"{latency['last']:.0f} ms, p95 {latency['p95']:.0f} ms" if latency else None
+        )
+        if discord_client:
+            limiter = discord_client.rate_limiter.get_stats()
+            events = discord_client.event_filter.get_stats()
+            self.discord_status.setToolTip(
+                f"Interactions sent: {limiter['acquired']}\n"
+                f"Rate limited: {limiter['rate_limited']} ({limiter['global_rate_limited']} global)\n"
+                f"Time waiting for rate limits: {limiter['wait_time']:.1f}s\n"
+                f"Gateway events passed: {events['passed']}, dropped: "
+                f"{events['ignored_event']} ignored, {events['other_channel']} other channel, "
+                f"{events['other_author']} other author"
+            )
+
     def show_generation_progress(self, show=True, message=None):
         """Mostra/nasconde indicatore di progresso generazione"""
         if not hasattr(self, 'progress_label'):
@@ -1437,6 +2091,72 @@ class MidjourneyStudioApp(QMainWindow):
         else:
             self.progress_label.hide()
 
+    def log_message(self, message):
+        """Accoda una riga di log; chiamabile da qualsiasi thread"""
+        self.event_bus.post(LOG, f"[{datetime.now().strftime('%H:%M:%S')}] {message}")
+
+    def append_log_messages(self, messages):
+        """Scrive nel pannello di log tutte le righe di un batch in un solo append"""
+        self.log_text.append("\n".join(messages))
+
+    def apply_status_updates(self, updates):
+        """Applica solo l'ultimo stato di ogni indicatore nel batch"""
+        latest = dict(updates)
+        for name, connected in latest.items():
+            indicator = getattr(self, f"{name}_status", None)
+            if indicator:
+                indicator.set_status(connected)
+
+    def flush_job_progress(self):
+        """Applica in un colpo solo gli aggiornamenti di avanzamento accumulati"""
+        discord_client = getattr(self, "discord_client", None)
+        if not discord_client:
+            return
+
+        updates = discord_client.progress.drain()
+        if not updates and not self.job_progress:
+            return
+
+        for job_key, update in updates.items():
+            if update["progress"] >= 100:
+                self.job_progress.pop(job_key, None)
+            else:
+                self.job_progress[job_key] = update
+
+        # Job senza aggiornamenti da 2 minuti: risultato non correlato o perso
+        now = time.monotonic()
+        stale = [key for key, update in self.job_progress.items() if now - update["updated_at"] > 120]
+        for job_key in stale:
+            del self.job_progress[job_key]
+
+        if updates or stale:
+            self.update_job_progress_view()
+
+    def update_job_progress_view(self):
+        """Mostra l'avanzamento dei job in corso"""
+        if not hasattr(self, 'jobs_progress_label'):
+            self.jobs_progress_label = QLabel()
+            self.jobs_progress_label.setStyleSheet("""
+                QLabel {
+                    background-color: #3498db;
+                    color: white;
+                    padding: 5px;
+                    border-radius: 3px;
+                }
+            """)
+            self.status_layout.addWidget(self.jobs_progress_label)
+
+        if not self.job_progress:
+            self.jobs_progress_label.hide()
+            return
+
+        parts = []
+        for update in self.job_progress.values():
+            label = (update["label"] or "")[:20]
+            parts.append(f"{label} {update['progress']}%")
+        self.jobs_progress_label.setText(f"{len(parts)} jobs: " + " | ".join(parts))
+        self.jobs_progress_label.show()
+
     def show_notification(self, message, level="info"):
         """Mostra una notifica all'utente"""
         colors = {
@@ -1545,18 +2265,8 @@ class MidjourneyStudioApp(QMainWindow):
                 return
 
             self.show_generation_progress(True, f"Upscaling U{index}...")
-            success = self.discord_client.send_upscale_command(
-                self.config["CHANNEL_ID"],
-                self.config["GUILD_ID"],
-                message_id,
-                index,
-                button_custom_id
-            )
-
-            if success:
-                self.log_message(f"[INFO] Upscale {index} command sent successfully")
-            else:
-                self.show_notification("Failed to send upscale command", "error")
+            self.discord_client.scheduler.submit_upscale(message_id, index, button_custom_id)
+            self.log_message(f"[INFO] Upscale {index} queued")
                 
         except Exception as e:
             self.log_message(f"[ERROR] Upscale failed: {str(e)}")
@@ -1579,17 +2289,8 @@ class MidjourneyStudioApp(QMainWindow):
                 return
 
             self.show_generation_progress(True, f"Generating variation V{index}...")
-            success = self.discord_client.send_variation_command(
-                self.config["CHANNEL_ID"],
-                self.config["GUILD_ID"],
-                message_id,
-                index
-            )
-
-            if success:
-                self.log_message(f"[INFO] Variation {index} command sent successfully")
-            else:
-                self.show_notification("Failed to send variation command", "error")
+            self.discord_client.scheduler.submit_variation(message_id, index)
+            self.log_message(f"[INFO] Variation {index} queued")
                 
         except Exception as e:
             self.log_message(f"[ERROR] Variation failed: {str(e)}")
@@ -1605,35 +2306,160 @@ class MidjourneyStudioApp(QMainWindow):
                 self.show_notification("No images selected", "warning")
                 return
                 
+            if self.is_analysis_running():
+                self.show_notification("Analysis already running", "warning")
+                return
+
+            if not hasattr(self, 'claude_manager'):
+                self.claude_manager = ClaudeAnalysisManager(self)
+
             self.analyze_btn.setEnabled(False)
-            self.show_generation_progress(True, "Analyzing images...")
-            
-            for image_path in selected_images:
-                self.log_message(f"[INFO] Analyzing {os.path.basename(image_path)}")
-                
-                # Analizza l'immagine con Claude
-                analysis_result = self.claude_client.analyze_image(image_path)
-                if analysis_result:
-                    # Aggiorna la vista dell'analisi
-                    self.update_analysis_view(analysis_result)
-                    
-                    # Aggiorna il tracking
-                    self.image_manager.image_tracking['analysis'][image_path] = analysis_result
-                    
-                    # Salva l'analisi
-                    analysis_path = f"{os.path.splitext(image_path)[0]}_analysis.txt"
-                    with open(analysis_path, 'w', encoding='utf-8') as f:
-                        json.dump(analysis_result, f, indent=2, ensure_ascii=False)
-                    
-                    self.show_notification(f"Analysis completed for {os.path.basename(image_path)}", "info")
-                else:
-                    self.show_notification(f"Analysis failed for {os.path.basename(image_path)}", "error")
-                    
-            self.image_manager.save_tracking_state()
-            
+            self.analysis_total = len(selected_images)
+            self.analysis_done = 0
+            self.analysis_cache_start = self.claude_manager.cache.get_stats()
+            self.analysis_usage_start = self.claude_manager.usage.get_usage()
+            self.show_generation_progress(True, f"Analyzing 0/{self.analysis_total} images...")
+            self.log_message(f"[INFO] Analyzing {self.analysis_total} images")
+
+            # Richieste concorrenti in un QThread: la finestra resta reattiva
+            self.analysis_worker = AnalysisWorker(
+                self.claude_manager,
+                selected_images,
+                api_key=self.config.get("CLAUDE_API_KEY"),
+                base_url=self.config.get("ANTHROPIC_BASE_URL"),
+                max_concurrency=self.config.get("ANALYSIS_CONCURRENCY", 4)
+            )
+            self.analysis_worker.resultReady.connect(self.handle_analysis_result)
+            self.analysis_worker.analysisFailed.connect(self.handle_analysis_failed)
+            self.analysis_worker.batchFinished.connect(self.handle_analysis_finished)
+            self.analysis_worker.start()
+
         except Exception as e:
             self.log_message(f"[ERROR] Analysis failed: {str(e)}")
             self.show_notification("Analysis failed", "error")
+            self.analyze_btn.setEnabled(True)
+            self.show_generation_progress(False)
+
+    def is_analysis_running(self):
+        worker = getattr(self, 'analysis_worker', None)
+        return bool(worker and worker.isRunning())
+
+    def stop_analysis(self):
+        """Interrompe l'analisi in corso; i Message Batches inviati riprendono al prossimo avvio"""
+        if not self.is_analysis_running():
+            return
+        self.stop_analysis_btn.setEnabled(False)
+        self.analysis_worker.cancel()
+        self.log_message("[INFO] Stopping analysis")
+
+    def analyze_folder_batch(self):
+        """Analizza tutta la cartella corrente con Message Batches: niente interattività, costo minore"""
+        if not hasattr(self, 'current_folder'):
+            self.show_notification("Please select a folder first", "warning")
+            return
+
+        image_paths = [
+            os.path.join(self.current_folder, f) for f in sorted(os.listdir(self.current_folder))
+            if f.lower().endswith(('.png', '.jpg', '.jpeg'))
+        ]
+        if not image_paths:
+            self.show_notification("No images in folder", "warning")
+            return
+        self.start_batch_analysis(image_paths)
+
+    def resume_analysis_batches(self):
+        """Riprende il polling dei batch ancora in corso"""
+        if os.path.exists(os.path.join(self.system_dir, "analysis_batches.json")):
+            self.start_batch_analysis([])
+
+    def start_batch_analysis(self, image_paths):
+        """Invia le immagini (se presenti) e attende i batch in corso in un QThread"""
+        try:
+            if self.is_analysis_running():
+                self.show_notification("Analysis already running", "warning")
+                return
+
+            if not hasattr(self, 'claude_manager'):
+                self.claude_manager = ClaudeAnalysisManager(self)
+
+            pending = {path for batch in self.claude_manager.batches.values() for path in batch["images"].values()}
+            if not image_paths and not pending:
+                return
+
+            self.analyze_btn.setEnabled(False)
+            self.analysis_total = len(pending | set(image_paths))
+            self.analysis_done = 0
+            self.analysis_cache_start = self.claude_manager.cache.get_stats()
+            self.analysis_usage_start = self.claude_manager.usage.get_usage()
+            self.show_generation_progress(True, f"Batch analysis: 0/{self.analysis_total} images...")
+            self.log_message(f"[INFO] Batch analysis of {self.analysis_total} images ({len(pending)} already submitted)")
+
+            self.analysis_worker = BatchAnalysisWorker(
+                self.claude_manager,
+                image_paths,
+                api_key=self.config.get("CLAUDE_API_KEY"),
+                base_url=self.config.get("ANTHROPIC_BASE_URL"),
+                poll_interval=self.config.get("BATCH_POLL_INTERVAL", 30)
+            )
+            self.analysis_worker.resultReady.connect(self.handle_analysis_result)
+            self.analysis_worker.analysisFailed.connect(self.handle_analysis_failed)
+            self.analysis_worker.batchFinished.connect(self.handle_analysis_finished)
+            self.analysis_worker.start()
+
+        except Exception as e:
+            self.log_message(f"[ERROR] Batch analysis failed: {str(e)}")
+            self.show_notification("Batch analysis failed", "error")
+            self.analyze_btn.setEnabled(True)
+            self.show_generation_progress(False)
+
+    def handle_analysis_result(self, image_path, analysis_result):
+        """Aggiorna vista e tracking appena un'analisi è pronta"""
+        try:
+            self.analysis_done += 1
+            self.show_generation_progress(True, f"Analyzing {self.analysis_done}/{self.analysis_total} images...")
+
+            # Aggiorna la vista dell'analisi
+            self.update_analysis_view("\n\n".join(
+                f"{section.replace('_', ' ').upper()}:\n{content}"
+                for section, content in analysis_result.items()
+            ))
+
+            # Aggiorna il tracking
+            self.image_manager.image_tracking['analysis'][image_path] = analysis_result
+            self.show_notification(f"Analysis completed for {os.path.basename(image_path)}", "info")
+
+        except Exception as e:
+            self.log_message(f"[ERROR] Failed to handle analysis result: {str(e)}")
+
+    def handle_analysis_failed(self, image_path):
+        """Conta l'immagine fallita senza interrompere il batch"""
+        self.analysis_done += 1
+        self.show_generation_progress(True, f"Analyzing {self.analysis_done}/{self.analysis_total} images...")
+        self.show_notification(f"Analysis failed for {os.path.basename(image_path)}", "error")
+
+    def handle_analysis_finished(self, completed, failed):
+        """Fine del batch: un solo salvataggio del tracking"""
+        try:
+            self.image_manager.save_tracking_state()
+            cache_stats = self.claude_manager.cache.get_stats()
+            hits = cache_stats["hits"] - self.analysis_cache_start["hits"]
+            misses = cache_stats["misses"] - self.analysis_cache_start["misses"]
+            self.log_message(
+                f"[INFO] Analysis finished: {completed} completed, {failed} failed "
+                f"(cache: {hits} hits, {misses} misses, {cache_stats['entries']} entries)"
+            )
+            usage = {
+                name: value - self.analysis_usage_start[name]
+                for name, value in self.claude_manager.usage.get_usage().items()
+            }
+            if usage["calls"]:
+                self.log_message(
+                    f"[INFO] Analysis tokens over {usage['calls']} calls: "
+                    f"{usage['input']} input, {usage['output']} output"
+                )
+            self.show_notification(f"Analysis finished: {hits} of {completed + failed} from cache", "info")
+        except Exception as e:
+            self.log_message(f"[ERROR] Failed to save analysis tracking: {str(e)}")
         finally:
             self.analyze_btn.setEnabled(True)
             self.show_generation_progress(False)
@@ -1677,66 +2503,290 @@ class MidjourneyStudioApp(QMainWindow):
             self.show_notification("Failed to process new image", "error")
 
 class MessageTracker:
-    def __init__(self):
-        self.tracked_messages = {}
-        self.active_generations = {}
+    def __init__(self, journal=None):
+        self.journal = journal
+        self.replaying = False
+        self.records = {}  # record_id -> record
+        self.tracked_messages = {}   # message_id -> record
+        self.active_generations = {}  # nonce -> record in attesa del risultato
         self.message_types = {
             "imagine": {},
             "upscale": {},
             "variation": {}
         }
-        self.cleanup_interval = 3600  # 1 ora in secondi
-        self.last_cleanup = time.time()
-
-    def track_message(self, message_id, message_type, original_id=None, data=None):
-        """Traccia un nuovo messaggio"""
-        self.tracked_messages[message_id] = {
+        # Indici secondari per correlazione O(1)
+        self.by_nonce = {}
+        self.by_interaction = {}
+        self.by_prompt_hash = {}
+        self.expiry_heap = []
+        self.heap_counter = itertools.count()
+        self.retention = 86400  # Mantieni per 24 ore
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def extract_prompt(content):
+        """Estrae il prompt dal testo di un messaggio Midjourney (**prompt** - ...)"""
+        match = PROMPT_PATTERN.search(content or "")
+        return match.group(1) if match else content
+
+    @staticmethod
+    def result_type(message_data):
+        """Tipo di job che può aver prodotto il messaggio: upscale e variazioni ripetono il prompt del padre"""
+        if "Image #" in (message_data.get("content") or ""):
+            return "upscale"
+        if message_data.get("message_reference"):
+            return "variation"
+        return "imagine"
+
+    @staticmethod
+    def hash_prompt(prompt):
+        """Hash del prompt normalizzato (minuscole, spazi compattati)"""
+        normalized = " ".join((prompt or "").lower().split())
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+    def _new_record(self, message_type, original_id, data, nonce=None, prompt=None):
+        data = data or {}
+        prompt = prompt or data.get("prompt")
+        now = time.monotonic()
+        return {
+            "record_id": nonce or uuid.uuid4().hex,
             "type": message_type,
             "original_id": original_id,
-            "timestamp": datetime.now().isoformat(),
-            "data": data or {},
-            "status": "pending"
+            "timestamp": time.time(),
+            "expires_at": now + self.retention,
+            "data": data,
+            "status": "pending",
+            "nonce": nonce,
+            "interaction_id": None,
+            "message_ids": [],
+            "prompt_hash": self.hash_prompt(prompt) if prompt else None
         }
-        self.message_types[message_type][message_id] = self.tracked_messages[message_id]
+
+    def _journal(self, op, record, payload=None):
+        """Registra una transizione nel journal persistente"""
+        if self.journal and not self.replaying:
+            self.journal.append(op, record["record_id"], payload)
+
+    @staticmethod
+    def snapshot(record):
+        """Copia serializzabile del record (senza tempi monotonic)"""
+        return {key: value for key, value in record.items() if key != "expires_at"}
+
+    def _index(self, record):
+        """Registra il record negli indici secondari e nell'heap di scadenza"""
+        record_id = record["record_id"]
+        self.records[record_id] = record
+        self.message_types[record["type"]][record_id] = record
+        if record["nonce"]:
+            self.by_nonce[record["nonce"]] = record
+        if record["prompt_hash"]:
+            self.by_prompt_hash.setdefault(record["prompt_hash"], {})[record_id] = record
+        heapq.heappush(self.expiry_heap, (record["expires_at"], next(self.heap_counter), record))
+
+    def _remove(self, record):
+        """Rimuove il record da tutti gli indici"""
+        record_id = record["record_id"]
+        if self.records.pop(record_id, None) is None:
+            return
+        self._journal("remove", record)
+        self.message_types[record["type"]].pop(record_id, None)
+        for message_id in record["message_ids"]:
+            self.tracked_messages.pop(message_id, None)
+        if record["nonce"]:
+            self.by_nonce.pop(record["nonce"], None)
+            self.active_generations.pop(record["nonce"], None)
+        if record["interaction_id"]:
+            self.by_interaction.pop(record["interaction_id"], None)
+        prompt_hash = record["prompt_hash"]
+        if prompt_hash and prompt_hash in self.by_prompt_hash:
+            self.by_prompt_hash[prompt_hash].pop(record_id, None)
+            if not self.by_prompt_hash[prompt_hash]:
+                del self.by_prompt_hash[prompt_hash]
+        if record["status"] == "pending":
+            record["status"] = "expired"
+
+    def _attach_message(self, record, message_id):
+        if message_id and message_id not in record["message_ids"]:
+            record["message_ids"].append(message_id)
+            self.tracked_messages[message_id] = record
+            self._journal("attach", record, {"message_id": message_id})
+
+    def track_message(self, message_id, message_type, original_id=None, data=None):
+        """Traccia un nuovo messaggio"""
+        with self.lock:
+            self.cleanup_old_messages()
+            existing = self.tracked_messages.get(message_id)
+            if existing:
+                self._remove(existing)
+            record = self._new_record(message_type, original_id, data)
+            record["message_ids"].append(message_id)
+            self.tracked_messages[message_id] = record
+            self._index(record)
+            self._journal("track", record, self.snapshot(record))
+            return record
+
+    def track_interaction(self, nonce, message_type, original_id=None, data=None):
+        """Traccia un'interazione inviata, prima che arrivi il messaggio risultato"""
+        with self.lock:
+            self.cleanup_old_messages()
+            record = self._new_record(message_type, original_id, data, nonce=nonce)
+            self.active_generations[nonce] = record
+            self._index(record)
+            self._journal("track", record, self.snapshot(record))
+            return record
+
+    def link_interaction(self, nonce, interaction_id):
+        """Collega il nonce inviato all'id dell'interazione creata da Discord"""
+        with self.lock:
+            record = self.by_nonce.get(nonce)
+            if record and interaction_id:
+                record["interaction_id"] = interaction_id
+                self.by_interaction[interaction_id] = record
+                self._journal("link", record, {"interaction_id": interaction_id})
+            return record
+
+    def link_message(self, nonce, message_id):
+        """Aggancia un messaggio al record di un'interazione già tracciata"""
+        with self.lock:
+            record = self.by_nonce.get(nonce)
+            if record:
+                self._attach_message(record, message_id)
+            return record
+
+    def resolve_message(self, message_data):
+        """Trova il record del job a cui appartiene un messaggio Midjourney"""
+        with self.lock:
+            message_id = message_data.get("id")
+            record = self.tracked_messages.get(message_id)
+
+            if record is None:
+                interaction = message_data.get("interaction_metadata") or message_data.get("interaction") or {}
+                record = self.by_interaction.get(interaction.get("id"))
+
+            if record is None and message_data.get("nonce"):
+                record = self.by_nonce.get(message_data["nonce"])
+
+            if record is None:
+                prompt_hash = self.hash_prompt(self.extract_prompt(message_data.get("content", "")))
+                message_type = self.result_type(message_data)
+                for candidate in self.by_prompt_hash.get(prompt_hash, {}).values():
+                    if candidate["status"] == "pending" and candidate["type"] == message_type:
+                        record = candidate
+                        break
+
+            if record is not None:
+                self._attach_message(record, message_id)
+            return record
 
     def update_status(self, message_id, status, additional_data=None):
-        """Aggiorna lo stato di un messaggio"""
-        if message_id in self.tracked_messages:
-            self.tracked_messages[message_id]["status"] = status
-            if additional_data:
-                self.tracked_messages[message_id]["data"].update(additional_data)
+        """Aggiorna lo stato di un messaggio (per message_id o nonce)"""
+        with self.lock:
+            record = (self.tracked_messages.get(message_id)
+                      or self.by_nonce.get(message_id)
+                      or self.records.get(message_id))
+            if record:
+                record["status"] = status
+                if additional_data:
+                    record["data"].update(additional_data)
+                if status != "pending" and record["nonce"]:
+                    self.active_generations.pop(record["nonce"], None)
+                self._journal("status", record, {"status": status, "data": additional_data})
+            return record
+
+    def restore(self):
+        """Ricostruisce lo stato dal journal; ritorna il numero di job in attesa"""
+        if not self.journal:
+            return 0
+
+        events = self.journal.read_events()
+        with self.lock:
+            self.replaying = True
+            try:
+                for op, record_id, payload in events:
+                    self._replay_event(op, record_id, payload)
+            finally:
+                self.replaying = False
+
+            self.cleanup_old_messages()
+            snapshots = [self.snapshot(record) for record in self.records.values()]
+            pending = len(self.active_generations)
+
+        self.journal.compact(snapshots, len(events))
+        return pending
+
+    def _replay_event(self, op, record_id, payload):
+        """Applica un evento del journal senza registrarlo di nuovo"""
+        if op == "track":
+            record = dict(payload)
+            age = time.time() - record["timestamp"]
+            if age >= self.retention:
+                return
+            record["expires_at"] = time.monotonic() + self.retention - age
+            existing = self.records.get(record_id)
+            if existing:
+                self._remove(existing)
+            self._index(record)
+            for message_id in record["message_ids"]:
+                self.tracked_messages[message_id] = record
+            if record["interaction_id"]:
+                self.by_interaction[record["interaction_id"]] = record
+            if record["nonce"] and record["status"] == "pending":
+                self.active_generations[record["nonce"]] = record
+            return
+
+        record = self.records.get(record_id)
+        if record is None:
+            return
+
+        if op == "attach":
+            self._attach_message(record, payload["message_id"])
+        elif op == "link":
+            record["interaction_id"] = payload["interaction_id"]
+            self.by_interaction[payload["interaction_id"]] = record
+        elif op == "status":
+            record["status"] = payload["status"]
+            if payload.get("data"):
+                record["data"].update(payload["data"])
+            if payload["status"] != "pending" and record["nonce"]:
+                self.active_generations.pop(record["nonce"], None)
+        elif op == "remove":
+            self._remove(record)
+
+    def update_progress(self, message_data, progress, preview_url=None):
+        """Aggiorna l'avanzamento del job (transitorio, non va nel journal)"""
+        with self.lock:
+            record = self.resolve_message(message_data)
+            if record:
+                record["data"]["progress"] = progress
+                record["data"]["preview_url"] = preview_url
+            return record
 
     def get_message_chain(self, message_id):
         """Ottiene la catena di messaggi correlati"""
         chain = []
+        seen = set()
         current_id = message_id
-        
-        while current_id:
-            if current_id in self.tracked_messages:
-                chain.append(self.tracked_messages[current_id])
-                current_id = self.tracked_messages[current_id].get("original_id")
-            else:
-                break
-                
+
+        with self.lock:
+            while current_id and current_id not in seen:
+                seen.add(current_id)
+                record = self.tracked_messages.get(current_id)
+                if record is None:
+                    break
+                chain.append(record)
+                current_id = record.get("original_id")
+
         return chain
 
     def cleanup_old_messages(self):
-        """Pulisce i messaggi vecchi"""
-        if time.time() - self.last_cleanup < self.cleanup_interval:
-            return
-            
-        current_time = datetime.now()
-        for message_id in list(self.tracked_messages.keys()):
-            message_time = datetime.fromisoformat(
-                self.tracked_messages[message_id]["timestamp"]
-            )
-            if (current_time - message_time).days > 1:  # Mantieni per 24 ore
-                message_type = self.tracked_messages[message_id]["type"]
-                del self.tracked_messages[message_id]
-                if message_id in self.message_types[message_type]:
-                    del self.message_types[message_type][message_id]
-        
-        self.last_cleanup = time.time()
+        """Pulisce i messaggi vecchi: O(log n) per record scaduto"""
+        with self.lock:
+            now = time.monotonic()
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                expires_at, _, record = heapq.heappop(self.expiry_heap)
+                # Voce obsoleta se il record è stato ri-tracciato o già rimosso
+                if record["expires_at"] == expires_at:
+                    self._remove(record)
 
 class FileManager:
     def __init__(self, app_reference):
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class AnalysisCache:
+    def __init__(self, app_reference, max_entries=5000, max_bytes=50 * 1024 * 1024):
+        """Cache persistente delle analisi: hash dell'immagine + hash delle impostazioni"""
+        self.app = app_reference
+        self.db_file = os.path.join(app_reference.system_dir, "analysis_cache.db")
+        self.max_entries = app_reference.config.get("ANALYSIS_CACHE_MAX_ENTRIES", max_entries)
+        self.max_bytes = app_reference.config.get("ANALYSIS_CACHE_MAX_MB", max_bytes / 1024 / 1024) * 1024 * 1024
+        self.lock = threading.Lock()
+        self.file_hashes = {}  # (percorso, dimensione, mtime) -> sha256
+        self.entries = 0
+        self.total_bytes = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stored": 0,
+            "evicted": 0
+        }
+        self.connection = None
+        self.open()
+
+    def open(self):
+        """Apre il database e legge occupazione e numero di voci"""
+        try:
+            self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS analyses ("
+                    "key TEXT PRIMARY KEY, result TEXT, size INTEGER, last_used REAL)"
+                )
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used)"
+                )
+            self.entries, self.total_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analyses"
+            ).fetchone()
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to open analysis cache: {str(e)}")
+            self.connection = None
+
+    @staticmethod
+    def settings_hash(**settings):
+        """Hash di prompt, modello e degli altri parametri della richiesta"""
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def image_hash(self, image_path):
+        """sha256 del contenuto; ricalcolato solo se dimensione o mtime cambiano"""
+        stat = os.stat(image_path)
+        file_key = (image_path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.file_hashes.get(file_key)
+        if cached:
+            return cached
+
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.file_hashes[file_key] = digest.hexdigest()
+        return digest.hexdigest()
+
+    def key(self, image_path, settings_hash):
+        return f"{self.image_hash(image_path)}:{settings_hash}"
+
+    def get(self, key):
+        """Analisi salvata per la chiave, o None"""
+        with self.lock:
+            row = None
+            if self.connection is not None:
+                try:
+                    row = self.connection.execute(
+                        "SELECT result FROM analyses WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row:
+                        with self.connection:
+                            self.connection.execute(
+                                "UPDATE analyses SET last_used = ? WHERE key = ?", (time.time(), key)
+                            )
+                except Exception as e:
+                    self.app.log_message(f"[ERROR] Analysis cache lookup failed: {str(e)}")
+                    row = None
+
+            self.stats["hits" if row else "misses"] += 1
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        """Salva un'analisi ed elimina le meno usate oltre i limiti"""
+        data = json.dumps(result, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self.lock:
+            if self.connection is None:
+                return
+            try:
+                with self.connection:
+                    previous = self.connection.execute(
+                        "SELECT size FROM analyses WHERE key = ?", (key,)
+                    ).fetchone()
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO analyses (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+                        (key, data, size, time.time())
+                    )
+                if previous:
+                    self.total_bytes -= previous[0]
+                else:
+                    self.entries += 1
+                self.total_bytes += size
+                self.stats["stored"] += 1
+                self.evict()
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Failed to store analysis in cache: {str(e)}")
+
+    def evict(self):
+        """LRU: rimuove le voci meno recenti finché numero e dimensione rientrano (con lock)"""
+        while self.entries > self.max_entries or self.total_bytes > self.max_bytes:
+            excess = max(1, self.entries - self.max_entries)
+            rows = self.connection.execute(
+                "SELECT key, size FROM analyses ORDER BY last_used LIMIT ?", (excess,)
+            ).fetchall()
+            if not rows:
+                break
+            with self.connection:
+                self.connection.executemany("DELETE FROM analyses WHERE key = ?", [(k,) for k, _ in rows])
+            self.entries -= len(rows)
+            self.total_bytes -= sum(size for _, size in rows)
+            self.stats["evicted"] += len(rows)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = self.entries
+            stats["bytes"] = self.total_bytes
+            return stats
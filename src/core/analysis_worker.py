@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+import anthropic
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class AnalysisWorker(QThread):
+    resultReady = pyqtSignal(str, dict)  # percorso, analisi per sezioni
+    analysisFailed = pyqtSignal(str)  # percorso
+    batchFinished = pyqtSignal(int, int)  # completate, fallite
+
+    def __init__(self, manager, image_paths, api_key=None, base_url=None, max_concurrency=4, parent=None):
+        """Analisi Claude concorrenti su un event loop dedicato, fuori dal thread Qt"""
+        super().__init__(parent)
+        self.manager = manager
+        self.image_paths = list(image_paths)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max(1, max_concurrency)
+        self.cancelled = False
+        self.loop = None
+        self.task = None
+        self.completed = 0
+        self.failed = 0
+
+    def cancel(self):
+        """Interrompe le richieste in corso e salta le immagini non ancora partite"""
+        self.cancelled = True
+        loop, task = self.loop, self.task
+        if loop and task:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # Loop già chiuso: il worker sta terminando
+                pass
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.task = self.loop.create_task(self.process_all())
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+            self.batchFinished.emit(self.completed, self.failed)
+
+    async def process_all(self):
+        # Client legato a questo loop; i retry su 429/529 sono gestiti dall'SDK
+        client = anthropic.AsyncAnthropic(api_key=self.api_key, base_url=self.base_url)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.gather(*(self.process(client, semaphore, path) for path in self.image_paths))
+        finally:
+            await client.close()
+
+    async def process(self, client, semaphore, image_path):
+        # Le analisi già in cache non aspettano uno slot libero
+        cache_key, result = await self.manager.cached_analysis(image_path)
+        if result is None:
+            async with semaphore:
+                if self.cancelled:
+                    return
+                result = await self.manager.analyze_image(image_path, client, cache_key)
+
+        # Ogni risultato arriva alla UI appena pronto, non a fine batch
+        if result:
+            self.completed += 1
+            self.resultReady.emit(image_path, result)
+        else:
+            self.failed += 1
+            self.analysisFailed.emit(image_path)
+
+
+class BatchAnalysisWorker(QThread):
+    resultReady = pyqtSignal(str, dict)
+    analysisFailed = pyqtSignal(str)
+    batchFinished = pyqtSignal(int, int)
+
+    def __init__(self, manager, image_paths=(), api_key=None, base_url=None, poll_interval=30, parent=None):
+        """Analisi di cartelle intere con Message Batches: invio, polling e raccolta"""
+        super().__init__(parent)
+        self.manager = manager
+        self.image_paths = list(image_paths)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.completed = 0
+        self.failed = 0
+
+    def cancel(self):
+        """Smette di attendere: i batch restano registrati e ripartono al prossimo avvio"""
+        self.stop_event.set()
+
+    def run(self):
+        client = anthropic.Anthropic(api_key=self.api_key, base_url=self.base_url)
+        try:
+            # Le immagini già in cache non finiscono nel batch
+            for image_path, result in self.manager.submit_batches(client, self.image_paths).items():
+                self.deliver(image_path, result)
+
+            while self.manager.batches and not self.stop_event.is_set():
+                for image_path, result in self.manager.poll_batches(client):
+                    self.deliver(image_path, result)
+                if self.manager.batches:
+                    self.stop_event.wait(self.poll_interval)
+
+        except Exception as e:
+            self.manager.app.log_message(f"[ERROR] Batch analysis failed: {str(e)}")
+        finally:
+            client.close()
+            self.batchFinished.emit(self.completed, self.failed)
+
+    def deliver(self, image_path, result):
+        if result:
+            self.completed += 1
+            self.resultReady.emit(image_path, result)
+        else:
+            self.failed += 1
+            self.analysisFailed.emit(image_path)
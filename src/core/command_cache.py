@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+
+
+class CommandCache:
+    def __init__(self, app_reference, fetch_commands, ttl=3600):
+        """Cache su disco dei descrittori dei comandi Midjourney"""
+        self.app = app_reference
+        self.fetch_commands = fetch_commands  # callable che ritorna la lista comandi o None
+        self.cache_file = os.path.join(app_reference.system_dir, "command_cache.json")
+        self.ttl = ttl  # validità del descrittore in secondi
+        self.refresh_margin = 300  # refresh in background 5 minuti prima della scadenza
+        self.commands = {}
+        self.fetched_at = 0
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.load_cache()
+
+    def load_cache(self):
+        """Carica i descrittori salvati nella sessione precedente"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.commands = state.get("commands", {})
+                self.fetched_at = state.get("fetched_at", 0)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to load command cache: {str(e)}")
+            self.commands = {}
+            self.fetched_at = 0
+
+    def save_cache(self):
+        """Salva i descrittori su disco in modo atomico"""
+        try:
+            temp_file = f"{self.cache_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({"fetched_at": self.fetched_at, "commands": self.commands}, f, indent=2)
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to save command cache: {str(e)}")
+
+    def age(self):
+        """Età del descrittore in secondi"""
+        return time.time() - self.fetched_at
+
+    def get(self, name):
+        """Ritorna il descrittore del comando, aggiornandolo solo se necessario"""
+        with self.lock:
+            descriptor = self.commands.get(name)
+            age = self.age()
+
+        if descriptor is None or age >= self.ttl:
+            # Nessun descrittore valido: fetch sincrono
+            if self.refresh():
+                with self.lock:
+                    return self.commands.get(name)
+            # Meglio un descrittore scaduto che nessun descrittore
+            return descriptor
+
+        if age >= self.ttl - self.refresh_margin:
+            self.refresh_async()
+
+        return descriptor
+
+    def refresh(self):
+        """Scarica i descrittori aggiornati da Discord"""
+        commands = self.fetch_commands()
+        if not commands:
+            return False
+
+        with self.lock:
+            self.commands = {
+                command["name"]: {
+                    "id": command["id"],
+                    "version": command["version"],
+                    "name": command["name"],
+                    "type": command.get("type", 1)
+                }
+                for command in commands
+                if "name" in command and "id" in command and "version" in command
+            }
+            self.fetched_at = time.time()
+            self.save_cache()
+        return True
+
+    def refresh_async(self):
+        """Avvia un refresh in background se non già in corso"""
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def worker():
+            try:
+                self.refresh()
+            finally:
+                with self.lock:
+                    self.refreshing = False
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def prefetch(self):
+        """Prepara la cache in background, senza bloccare il chiamante"""
+        with self.lock:
+            needs_refresh = not self.commands or self.age() >= self.ttl - self.refresh_margin
+        if needs_refresh:
+            self.refresh_async()
+
+    def invalidate(self):
+        """Invalida la cache dopo che Discord ha rifiutato una versione"""
+        with self.lock:
+            self.commands = {}
+            self.fetched_at = 0
+            self.save_cache()
+        self.app.log_message("[INFO] Command cache invalidated")
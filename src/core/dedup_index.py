@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+
+class DedupIndex:
+    def __init__(self, app_reference):
+        """Indice persistente di allegati già scaricati e hash dei file salvati"""
+        self.app = app_reference
+        self.db_file = os.path.join(app_reference.system_dir, "dedup_index.db")
+        self.lock = threading.Lock()
+        self.attachments = {}  # chiave allegato -> percorso
+        self.hashes = {}  # sha256 -> percorso
+        self.in_progress = set()
+        self.connection = None
+        self.load_index()
+
+    def load_index(self):
+        """Apre il database e carica l'indice in memoria"""
+        try:
+            self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS attachments (key TEXT PRIMARY KEY, sha256 TEXT, path TEXT)"
+                )
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS contents (sha256 TEXT PRIMARY KEY, path TEXT)"
+                )
+            self.attachments = dict(self.connection.execute("SELECT key, path FROM attachments"))
+            self.hashes = dict(self.connection.execute("SELECT sha256, path FROM contents"))
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to load dedup index: {str(e)}")
+            self.connection = None
+
+    @staticmethod
+    def attachment_key(attachment):
+        """Id dell'allegato, o URL senza query string (i parametri firmati cambiano)"""
+        if attachment.get("id"):
+            return f"id:{attachment['id']}"
+        parts = urlsplit(attachment.get("url", ""))
+        return f"url:{parts.netloc}{parts.path}"
+
+    def claim(self, key):
+        """True se l'allegato va scaricato; False se già salvato o in download"""
+        with self.lock:
+            if key in self.in_progress or key in self.attachments:
+                return False
+            self.in_progress.add(key)
+            return True
+
+    def release(self, key):
+        """Libera un allegato il cui download è fallito"""
+        with self.lock:
+            self.in_progress.discard(key)
+
+    def find_content(self, sha256):
+        """Percorso di un file già salvato con lo stesso contenuto, se esiste ancora"""
+        with self.lock:
+            path = self.hashes.get(sha256)
+        if path and os.path.exists(path):
+            return path
+        return None
+
+    def record(self, key, sha256, path, duplicate=False):
+        """Registra un allegato salvato (o duplicato di un file esistente) e il suo hash"""
+        with self.lock:
+            self.in_progress.discard(key)
+            self.attachments[key] = path
+            if not duplicate:
+                # Contenuto nuovo (o vecchio file rimosso): diventa il riferimento
+                self.hashes[sha256] = path
+            if self.connection is None:
+                return
+            try:
+                with self.connection:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO attachments (key, sha256, path) VALUES (?, ?, ?)",
+                        (key, sha256, path)
+                    )
+                    if not duplicate:
+                        self.connection.execute(
+                            "INSERT OR REPLACE INTO contents (sha256, path) VALUES (?, ?)",
+                            (sha256, path)
+                        )
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Failed to update dedup index: {str(e)}")
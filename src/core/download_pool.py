@@ -0,0 +1,260 @@
+import os
+import time
+import queue
+import random
+import shutil
+import hashlib
+import threading
+
+from core.job_journal import JobJournal
+
+
+class DownloadPool:
+    def __init__(self, app_reference, http_transport, path_factory, on_complete,
+                 dedup_index=None, max_workers=4):
+        """Pool di thread per scaricare gli allegati fuori dal thread WebSocket"""
+        self.app = app_reference
+        self.http = http_transport
+        self.path_factory = path_factory  # context -> percorso, chiamata solo a file completo
+        self.on_complete = on_complete  # (percorso, context) a download concluso
+        self.dedup_index = dedup_index
+        self.max_workers = max_workers
+        self.chunk_size = 64 * 1024  # 64 KB per chunk
+        # Cartella dedicata: i parziali sopravvivono alla pulizia di system/temp
+        self.partial_dir = os.path.join(app_reference.system_dir, "downloads")
+        # Ogni download accodato resta nel journal finché non è concluso o abbandonato
+        self.journal = JobJournal(app_reference, "download_journal.db")
+        self.base_retry_delay = 2
+        self.max_retry_delay = 600  # 10 minuti
+        self.max_age = 86400  # gli URL firmati della CDN scadono: si rinuncia dopo 24 ore
+        self.jobs = queue.Queue()
+        self.path_lock = threading.Lock()
+        self.retry_lock = threading.Lock()
+        self.retry_queue = {}  # chiave allegato -> entry in attesa del prossimo tentativo
+        self.retry_event = threading.Event()
+        self.workers = []
+        self.stopping = False
+
+    def start(self):
+        """Avvia i worker e ripristina i download rimasti in sospeso"""
+        if self.workers:
+            return
+        os.makedirs(self.partial_dir, exist_ok=True)
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._run, name=f"download-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.restore()
+        retry_worker = threading.Thread(target=self._run_retries, name="download-retry", daemon=True)
+        retry_worker.start()
+        self.workers.append(retry_worker)
+
+    def submit(self, url, context, key, size=None):
+        """Accoda un download; context deve essere serializzabile in JSON"""
+        self.start()
+        entry = {
+            "url": url,
+            "key": key,
+            "size": size,
+            "context": context,
+            "attempts": 0,
+            "next_attempt": 0,
+            "first_seen": time.time()
+        }
+        self.journal.append("track", key, entry)
+        self.jobs.put(entry)
+
+    def stop(self):
+        """Ferma i worker; i download non conclusi restano nel journal per il prossimo avvio"""
+        self.stopping = True
+        for _ in range(self.max_workers):
+            self.jobs.put(None)
+        self.retry_event.set()
+        self.journal.close()
+
+    def _run(self):
+        while True:
+            entry = self.jobs.get()
+            if entry is None:
+                self.jobs.task_done()
+                return
+            try:
+                result = self.download(entry)
+                if result is None:
+                    self.schedule_retry(entry)
+                else:
+                    self.journal.append("remove", entry["key"])
+                    save_path, duplicate = result
+                    if duplicate:
+                        # Stesso contenuto già in galleria: niente nuovo file, segnale o split
+                        self.app.log_message(
+                            f"[INFO] Attachment identical to {os.path.basename(save_path)}, skipped"
+                        )
+                    else:
+                        self.on_complete(save_path, entry["context"])
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Download callback failed: {str(e)}")
+            finally:
+                self.jobs.task_done()
+
+    def partial_path(self, key):
+        """File parziale stabile per allegato: permette di riprendere con Range"""
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.partial_dir, f"{name}.part")
+
+    def download(self, entry):
+        """Scarica (o riprende) in streaming e sposta il file completo in modo atomico.
+
+        Ritorna (percorso, duplicato) oppure None se il download va ritentato.
+        """
+        key = entry["key"]
+        expected_size = entry.get("size")
+        partial_path = self.partial_path(key)
+
+        try:
+            offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            if expected_size and offset > expected_size:
+                os.remove(partial_path)
+                offset = 0
+
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            with self.http.download(entry["url"], stream=True, headers=headers) as response:
+                if response.status_code == 416 and offset and offset == expected_size:
+                    # Il parziale era già completo
+                    mode = None
+                elif response.status_code == 206 and offset:
+                    mode = 'ab'
+                elif response.status_code == 200:
+                    # Range ignorato dal server: si riparte da zero
+                    mode = 'wb'
+                else:
+                    self.app.log_message(f"[ERROR] Failed to download attachment: {response.status_code}")
+                    return None
+
+                if mode:
+                    with open(partial_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if chunk:
+                                f.write(chunk)
+                        f.flush()
+                        os.fsync(f.fileno())
+
+            # Controllo di integrità sulla dimensione dichiarata da Discord
+            total_size = os.path.getsize(partial_path)
+            if expected_size and total_size != expected_size:
+                self.app.log_message(
+                    f"[ERROR] Incomplete attachment: {total_size} of {expected_size} bytes"
+                )
+                if total_size > expected_size:
+                    os.remove(partial_path)
+                return None
+
+            sha256 = self.hash_file(partial_path)
+            return self.finalize(partial_path, sha256, entry["context"], key)
+
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to download attachment: {str(e)}")
+            return None
+
+    def hash_file(self, path):
+        """sha256 del file intero, incluse le parti scaricate in tentativi precedenti"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def finalize(self, partial_path, sha256, context, key):
+        """Sceglie il nome e sposta il file; un contenuto già presente riusa il file esistente"""
+        existing = self.dedup_index.find_content(sha256) if self.dedup_index else None
+        if existing:
+            # Nessun numero di sequenza consumato: l'allegato punta al file già salvato
+            os.remove(partial_path)
+            self.dedup_index.record(key, sha256, existing, duplicate=True)
+            return existing, True
+
+        # Scelta del nome e rename sotto lock: nessuna collisione tra worker
+        with self.path_lock:
+            save_path = self.path_factory(context)
+            try:
+                os.replace(partial_path, save_path)
+            except OSError:
+                # Parziale e destinazione su filesystem diversi
+                shutil.move(partial_path, save_path)
+
+        if self.dedup_index:
+            self.dedup_index.record(key, sha256, save_path)
+        return save_path, False
+
+    def schedule_retry(self, entry):
+        """Rimette il download in attesa con backoff esponenziale, registrandolo nel journal"""
+        entry["attempts"] += 1
+
+        if time.time() - entry["first_seen"] > self.max_age:
+            self.app.log_message(f"[ERROR] Giving up on attachment after {entry['attempts']} attempts")
+            self._abandon(entry)
+            return
+
+        # Full jitter tra metà e intero ritardo: i worker non ritentano all'unisono
+        delay = min(self.max_retry_delay, self.base_retry_delay * (2 ** entry["attempts"]))
+        entry["next_attempt"] = time.time() + random.uniform(delay / 2, delay)
+        self.journal.append("retry", entry["key"], {
+            "attempts": entry["attempts"],
+            "next_attempt": entry["next_attempt"]
+        })
+        with self.retry_lock:
+            self.retry_queue[entry["key"]] = entry
+        self.retry_event.set()
+
+    def _abandon(self, entry):
+        self.journal.append("remove", entry["key"])
+        partial_path = self.partial_path(entry["key"])
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        if self.dedup_index:
+            self.dedup_index.release(entry["key"])
+
+    def _run_retries(self):
+        """Rimette in coda i download il cui backoff è scaduto"""
+        while not self.stopping:
+            with self.retry_lock:
+                now = time.time()
+                due = [entry for entry in self.retry_queue.values() if entry["next_attempt"] <= now]
+                for entry in due:
+                    del self.retry_queue[entry["key"]]
+                waits = [entry["next_attempt"] - now for entry in self.retry_queue.values()]
+
+            for entry in due:
+                self.jobs.put(entry)
+
+            self.retry_event.wait(timeout=min(waits) if waits else None)
+            self.retry_event.clear()
+
+    def restore(self):
+        """Riaccoda i download non conclusi nelle sessioni precedenti"""
+        events = self.journal.read_events()
+        pending = {}
+        for op, key, payload in events:
+            if op == "track":
+                pending[key] = payload
+            elif op == "retry" and key in pending:
+                pending[key].update(payload)
+            elif op == "remove":
+                pending.pop(key, None)
+        self.journal.compact(list(pending.values()), len(events), key="key")
+
+        now = time.time()
+        restored = 0
+        for key, entry in pending.items():
+            # Riserva la chiave: lo stesso allegato non viene riaccodato dal gateway
+            if self.dedup_index and not self.dedup_index.claim(key):
+                self.journal.append("remove", key)
+                continue
+            restored += 1
+            if entry["next_attempt"] > now:
+                with self.retry_lock:
+                    self.retry_queue[key] = entry
+            else:
+                self.jobs.put(entry)
+        if restored:
+            self.app.log_message(f"[INFO] Restored {restored} pending downloads")
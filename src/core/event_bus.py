@@ -0,0 +1,47 @@
+from collections import deque
+
+# Tipi di evento
+LOG = "log"  # payload: riga di log già formattata
+STATUS = "status"  # payload: (nome indicatore, connesso)
+
+
+class EventBus:
+    def __init__(self, max_batch=1000):
+        """Coda tra thread di rete/worker e thread Qt, svuotata a batch dal timer della UI"""
+        # deque.append/popleft sono atomici: nessun lock sul percorso dei thread di rete
+        self.events = deque()
+        self.handlers = {}
+        self.max_batch = max_batch
+
+    def post(self, kind, payload=None):
+        """Accoda un evento; chiamabile da qualsiasi thread"""
+        self.events.append((kind, payload))
+
+    def subscribe(self, kind, handler):
+        """Registra l'handler (thread Qt) che riceve la lista dei payload di un batch"""
+        self.handlers[kind] = handler
+
+    def drain(self):
+        """Consegna gli eventi accumulati raggruppati per tipo (solo dal thread Qt)"""
+        batch = {}
+        count = 0
+        while count < self.max_batch:
+            try:
+                kind, payload = self.events.popleft()
+            except IndexError:
+                break
+            batch.setdefault(kind, []).append(payload)
+            count += 1
+
+        if not count:
+            return 0
+
+        for kind, payloads in batch.items():
+            handler = self.handlers.get(kind)
+            if handler is None:
+                continue
+            try:
+                handler(payloads)
+            except Exception as e:
+                self.post(LOG, f"[ERROR] Event handler for {kind} failed: {str(e)}")
+        return count
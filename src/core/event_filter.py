@@ -0,0 +1,92 @@
+import re
+import threading
+
+# Discord serializza t/s/op prima di d: bastano i primi byte del payload.
+# I pattern tollerano spazi dopo i due punti, come qualsiasi JSON valido
+TYPE_PATTERN = re.compile(rb'"t"\s*:\s*"([A-Z_]+)"')
+SEQ_PATTERN = re.compile(rb'"s"\s*:\s*(\d+)')
+DISPATCH_PATTERN = re.compile(rb'"op"\s*:\s*0\b')
+CHANNEL_PATTERN = re.compile(rb'"channel_id"\s*:\s*"(\d+)"')
+AUTHOR_PATTERN = re.compile(rb'"author"\s*:\s*\{')
+
+MESSAGE_EVENTS = {"MESSAGE_CREATE", "MESSAGE_UPDATE"}
+
+
+class EventFilter:
+    def __init__(self, handled_events, author_id="936929561302675456"):
+        """Scarta i dispatch non pertinenti prima del parsing JSON"""
+        self.handled_events = set(handled_events) | {"READY", "RESUMED"}
+        self.author_id = author_id
+        self.author_pattern = re.compile(rb'"id"\s*:\s*"' + author_id.encode() + rb'"')
+        self.channel_id = None
+        self.lock = threading.Lock()
+        self.drops = {
+            "ignored_event": 0,
+            "other_channel": 0,
+            "other_author": 0
+        }
+        self.passed = 0
+
+    def configure(self, channel_id):
+        """Imposta il canale monitorato (None = tutti i canali)"""
+        self.channel_id = str(channel_id) if channel_id else None
+
+    def _drop(self, reason):
+        with self.lock:
+            self.drops[reason] += 1
+        return reason
+
+    def inspect(self, raw):
+        """Ritorna (motivo, sequence) se il payload grezzo va scartato, altrimenti None"""
+        if isinstance(raw, str):
+            raw = raw.encode()
+
+        data_start = raw.find(b'"d":')
+        head = raw[:data_start] if data_start != -1 else raw
+        if not DISPATCH_PATTERN.search(head):
+            return None
+
+        type_match = TYPE_PATTERN.search(head)
+        seq_match = SEQ_PATTERN.search(head)
+        if not type_match or not seq_match:
+            # Ordine dei campi inatteso: si lascia decidere al parsing completo
+            return None
+
+        event_type = type_match.group(1).decode()
+        sequence = int(seq_match.group(1))
+
+        if event_type not in self.handled_events:
+            return self._drop("ignored_event"), sequence
+
+        # Si scarta solo se il controllo è conclusivo; nel dubbio decide accept()
+        if event_type in MESSAGE_EVENTS:
+            if self.channel_id:
+                # Anche i channel_id annidati (message_reference): il nostro deve mancare in tutti
+                channels = CHANNEL_PATTERN.findall(raw)
+                if channels and self.channel_id.encode() not in channels:
+                    return self._drop("other_channel"), sequence
+            if AUTHOR_PATTERN.search(raw) and not self.author_pattern.search(raw):
+                return self._drop("other_author"), sequence
+
+        return None
+
+    def accept(self, event_type, data):
+        """Controllo esatto sul payload decodificato"""
+        if event_type in MESSAGE_EVENTS:
+            if self.channel_id and str(data.get("channel_id")) != self.channel_id:
+                self._drop("other_channel")
+                return False
+            if (data.get("author") or {}).get("id") != self.author_id:
+                self._drop("other_author")
+                return False
+
+        with self.lock:
+            self.passed += 1
+        return True
+
+    def get_stats(self):
+        """Contatori degli eventi scartati per motivo"""
+        with self.lock:
+            stats = dict(self.drops)
+            stats["passed"] = self.passed
+            return stats
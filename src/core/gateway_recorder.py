@@ -0,0 +1,51 @@
+import gzip
+import time
+import threading
+
+
+class GatewayRecorder:
+    def __init__(self, app_reference, path):
+        """Registra i payload del gateway (già decompressi) con il loro istante"""
+        self.app = app_reference
+        self.path = path
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.frames = 0
+        self.file = None
+
+    def record(self, raw):
+        """Una riga per frame: offset in secondi, tab, payload JSON compatto"""
+        if isinstance(raw, (bytes, bytearray)):
+            raw = raw.decode("utf-8")
+        with self.lock:
+            try:
+                if self.file is None:
+                    self.file = gzip.open(self.path, "at", encoding="utf-8")
+                    self.started_at = time.monotonic()
+                self.file.write(f"{time.monotonic() - self.started_at:.6f}\t{raw}\n")
+                self.frames += 1
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Failed to record gateway frame: {str(e)}")
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def load_recording(path):
+    """Ritorna [(offset, payload)] di una registrazione; più sessioni vengono accodate"""
+    frames = []
+    base = 0.0
+    previous = 0.0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            offset, _, payload = line.rstrip("\n").partition("\t")
+            offset = float(offset)
+            if offset < previous:
+                # Nuova sessione di registrazione nello stesso file
+                base += previous
+            previous = offset
+            frames.append((base + offset, payload))
+    return frames
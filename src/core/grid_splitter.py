@@ -0,0 +1,73 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+
+def split_grid(grid_path, output_paths):
+    """Ritaglia una griglia 2x2 nei quattro quadranti (eseguita in un processo separato)"""
+    with Image.open(grid_path) as grid:
+        grid.load()
+        width, height = grid.size
+        half_width, half_height = width // 2, height // 2
+        boxes = [
+            (0, 0, half_width, half_height),  # U1/V1: alto a sinistra
+            (half_width, 0, width, half_height),  # U2/V2: alto a destra
+            (0, half_height, half_width, height),  # U3/V3: basso a sinistra
+            (half_width, half_height, width, height)  # U4/V4: basso a destra
+        ]
+        for box, output_path in zip(boxes, output_paths):
+            temp_path = f"{output_path}.tmp"
+            grid.crop(box).save(temp_path, format=grid.format or "PNG")
+            os.replace(temp_path, output_path)
+    return output_paths
+
+
+class GridSplitter:
+    def __init__(self, app_reference, on_quadrant, max_workers=None):
+        """Divide le griglie 2x2 di /imagine in quadranti, in un pool di processi"""
+        self.app = app_reference
+        self.on_quadrant = on_quadrant  # (percorso, indice, context) per ogni quadrante
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_grid(buttons_data):
+        """Una griglia espone U1-U4: gli upscale hanno solo i bottoni del singolo quadrante"""
+        return all(f"upscale_{index}" in buttons_data for index in range(1, 5))
+
+    @staticmethod
+    def quadrant_paths(grid_path):
+        """Percorsi dei quadranti accanto alla griglia: img_001_q1.png ... img_001_q4.png"""
+        base, extension = os.path.splitext(grid_path)
+        return [f"{base}_q{index}{extension}" for index in range(1, 5)]
+
+    def submit(self, grid_path, context):
+        """Accoda la divisione di una griglia; i quadranti arrivano a on_quadrant"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            future = self.executor.submit(split_grid, grid_path, self.quadrant_paths(grid_path))
+        future.add_done_callback(lambda f: self._on_done(f, grid_path, context))
+
+    def _on_done(self, future, grid_path, context):
+        try:
+            output_paths = future.result()
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to split grid {grid_path}: {str(e)}")
+            return
+
+        for index, output_path in enumerate(output_paths, start=1):
+            try:
+                self.on_quadrant(output_path, index, context)
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Quadrant callback failed: {str(e)}")
+
+    def shutdown(self):
+        """Chiude il pool senza attendere le griglie in coda"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
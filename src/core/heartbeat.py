@@ -0,0 +1,103 @@
+import json
+import time
+import random
+import threading
+from collections import deque
+
+
+class LatencyHistogram:
+    def __init__(self, size=100):
+        """Finestra mobile delle ultime latenze heartbeat (secondi)"""
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def summary(self):
+        """Ultima latenza e percentili in millisecondi"""
+        with self.lock:
+            samples = list(self.samples)
+        if not samples:
+            return None
+
+        ordered = sorted(samples)
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+        return {
+            "last": samples[-1] * 1000,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "max": ordered[-1] * 1000,
+            "count": len(samples)
+        }
+
+
+class Heartbeat:
+    def __init__(self, app_reference, ws, interval_ms, get_sequence, histogram):
+        """Heartbeat del gateway con verifica degli ACK (op 11)"""
+        self.app = app_reference
+        self.ws = ws
+        self.interval = interval_ms / 1000
+        self.get_sequence = get_sequence
+        self.histogram = histogram
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.ack_received = True
+        self.sent_at = None
+        self.beats = 0
+        self.missed_acks = 0
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def beat(self):
+        """Invia un heartbeat (anche su richiesta del gateway, op 1)"""
+        with self.lock:
+            self.ws.send(json.dumps({"op": 1, "d": self.get_sequence()}))
+            self.sent_at = time.monotonic()
+            self.ack_received = False
+            self.beats += 1
+
+    def on_ack(self):
+        """Registra l'ACK e la latenza di andata e ritorno"""
+        with self.lock:
+            if self.sent_at is not None and not self.ack_received:
+                self.histogram.record(time.monotonic() - self.sent_at)
+            self.ack_received = True
+
+    def _run(self):
+        # Primo beat dopo interval * jitter, come richiesto da Discord
+        next_beat = time.monotonic() + self.interval * random.random()
+        while True:
+            if self.stop_event.wait(max(0, next_beat - time.monotonic())):
+                return
+
+            with self.lock:
+                zombie = not self.ack_received
+            if zombie:
+                # Nessun ACK dall'ultimo beat: connessione zombie, si chiude per riprendere
+                self.missed_acks += 1
+                self.app.log_message("[ERROR] Heartbeat ACK missed, reconnecting")
+                try:
+                    self.ws.close(status=4000)
+                except Exception as e:
+                    self.app.log_message(f"[ERROR] Failed to close zombie connection: {str(e)}")
+                return
+
+            try:
+                self.beat()
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Heartbeat failed: {str(e)}")
+                return
+
+            # Scadenze assolute: nessuna deriva accumulata dallo sleep
+            next_beat += self.interval
+            now = time.monotonic()
+            if next_beat < now:
+                next_beat = now + self.interval
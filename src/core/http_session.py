@@ -0,0 +1,50 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpTransport:
+    def __init__(self, headers, api_pool_size=10, cdn_pool_size=20, timeout=(5, 30)):
+        """Sessioni HTTP keep-alive condivise per REST API e CDN di Discord"""
+        self.timeout = timeout  # (connect, read) in secondi
+        # REST API: usa gli header autenticati del client
+        self.api = self.create_session(headers, api_pool_size)
+        # CDN: nessun token, solo User-Agent
+        self.cdn = self.create_session(
+            {"User-Agent": headers.get("User-Agent", "")},
+            cdn_pool_size
+        )
+
+    def create_session(self, headers, pool_size):
+        """Crea una sessione con connection pool dimensionato per host"""
+        session = requests.Session()
+        session.headers.update(headers)
+        adapter = HTTPAdapter(
+            pool_connections=4,  # numero di host distinti in cache
+            pool_maxsize=pool_size,  # connessioni keep-alive per host
+            max_retries=0
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(self, session, method, url, **kwargs):
+        """Esegue una richiesta applicando il timeout di default"""
+        kwargs.setdefault("timeout", self.timeout)
+        return session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """GET verso la REST API"""
+        return self.request(self.api, "GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """POST verso la REST API"""
+        return self.request(self.api, "POST", url, **kwargs)
+
+    def download(self, url, **kwargs):
+        """GET verso la CDN degli allegati"""
+        return self.request(self.cdn, "GET", url, **kwargs)
+
+    def close(self):
+        """Chiude tutte le connessioni aperte"""
+        self.api.close()
+        self.cdn.close()
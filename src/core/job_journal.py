@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+
+
+class JobJournal:
+    def __init__(self, app_reference, filename="job_journal.db", batch_size=100, flush_interval=0.2):
+        """Journal append-only (SQLite WAL): transizioni del MessageTracker, download in sospeso"""
+        self.app = app_reference
+        self.db_file = os.path.join(app_reference.system_dir, filename)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # secondi massimi tra due commit
+        self.compact_ratio = 4  # compatta se gli eventi superano 4x i record vivi
+        self.pending = queue.Queue()
+        self.writer = None
+        self.closed = False
+        self.init_database()
+
+    def connect(self):
+        connection = sqlite3.connect(self.db_file)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # FULL: ogni commit (cioè ogni batch) è un fsync
+        connection.execute("PRAGMA synchronous=FULL")
+        return connection
+
+    def init_database(self):
+        """Crea la tabella degli eventi se non esiste"""
+        try:
+            connection = self.connect()
+            try:
+                with connection:
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS events (
+                            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                            ts REAL NOT NULL,
+                            op TEXT NOT NULL,
+                            record_id TEXT NOT NULL,
+                            payload TEXT
+                        )
+                    """)
+            finally:
+                connection.close()
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to initialize job journal: {str(e)}")
+
+    def start(self):
+        """Avvia il thread di scrittura"""
+        if self.writer:
+            return
+        self.writer = threading.Thread(target=self._run, daemon=True)
+        self.writer.start()
+
+    def append(self, op, record_id, payload=None):
+        """Accoda un evento; viene scritto nel prossimo batch"""
+        if self.closed:
+            return
+        self.start()
+        self.pending.put((time.time(), op, record_id, json.dumps(payload) if payload is not None else None))
+
+    def _run(self):
+        connection = self.connect()
+        try:
+            while True:
+                batch = [self.pending.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.pending.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                stop = None in batch
+                events = [event for event in batch if event is not None]
+                if events:
+                    try:
+                        with connection:
+                            connection.executemany(
+                                "INSERT INTO events (ts, op, record_id, payload) VALUES (?, ?, ?, ?)",
+                                events
+                            )
+                    except Exception as e:
+                        self.app.log_message(f"[ERROR] Failed to write job journal: {str(e)}")
+
+                for _ in batch:
+                    self.pending.task_done()
+                if stop:
+                    return
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Attende che tutti gli eventi accodati siano su disco"""
+        if self.writer:
+            self.pending.join()
+
+    def close(self):
+        """Scrive gli eventi rimasti e ferma il thread"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer:
+            self.pending.put(None)
+            self.writer.join()
+
+    def read_events(self):
+        """Ritorna tutti gli eventi in ordine di scrittura"""
+        try:
+            connection = self.connect()
+            try:
+                rows = connection.execute(
+                    "SELECT op, record_id, payload FROM events ORDER BY seq"
+                ).fetchall()
+            finally:
+                connection.close()
+            return [(op, record_id, json.loads(payload) if payload else None)
+                    for op, record_id, payload in rows]
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to read job journal: {str(e)}")
+            return []
+
+    def compact(self, snapshots, event_count, key="record_id"):
+        """Riscrive il journal con un solo evento "track" per record vivo"""
+        if event_count <= self.compact_ratio * max(len(snapshots), 1):
+            return
+        try:
+            now = time.time()
+            connection = self.connect()
+            try:
+                with connection:
+                    connection.execute("DELETE FROM events")
+                    connection.executemany(
+                        "INSERT INTO events (ts, op, record_id, payload) VALUES (?, ?, ?, ?)",
+                        [(now, "track", snapshot[key], json.dumps(snapshot)) for snapshot in snapshots]
+                    )
+            finally:
+                connection.close()
+            self.app.log_message(f"[INFO] Job journal compacted: {event_count} -> {len(snapshots)} events")
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to compact job journal: {str(e)}")
@@ -0,0 +1,236 @@
+import time
+import heapq
+import uuid
+import random
+import itertools
+import threading
+
+
+class GenerationJob:
+    def __init__(self, job_type, params, priority):
+        """Job di generazione in coda o in esecuzione"""
+        self.job_id = uuid.uuid4().hex
+        self.type = job_type
+        self.params = params
+        self.priority = priority
+        self.status = "queued"
+        self.attempts = 0
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.nonce = None
+        self.result_message_id = None
+
+
+class JobScheduler:
+    # Upscale e variazioni hanno precedenza sui nuovi imagine
+    PRIORITIES = {"upscale": 0, "variation": 0, "imagine": 1}
+
+    def __init__(self, app_reference, discord_client, max_slots=3):
+        """Scheduler dei job Midjourney con slot di concorrenza"""
+        self.app = app_reference
+        self.discord_client = discord_client
+        self.max_slots = max_slots  # job paralleli consentiti dal piano Midjourney
+        self.max_attempts = 3
+        self.base_retry_delay = 2
+        self.max_retry_delay = 60
+        self.job_timeout = 600  # libera lo slot dopo 10 minuti senza risultato
+        self.queue = []
+        self.counter = itertools.count()
+        self.in_flight = {}
+        self.delayed = []  # (not_before, contatore, job) in attesa del backoff
+        self.session_ready = False  # dispatch sospeso finché il gateway non è READY/RESUMED
+        self.condition = threading.Condition()
+        self.running = False
+        self.worker = None
+
+    def start(self):
+        """Avvia il thread di dispatch"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.max_slots = self.app.config.get("MAX_CONCURRENT_JOBS", self.max_slots)
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        """Ferma il thread di dispatch"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def set_session_ready(self, ready):
+        """Sospende o riprende il dispatch secondo lo stato della sessione gateway"""
+        with self.condition:
+            self.session_ready = ready
+            self.condition.notify_all()
+
+    def submit(self, job_type, priority=None, **params):
+        """Accoda un job e ritorna l'oggetto GenerationJob"""
+        if priority is None:
+            priority = self.PRIORITIES[job_type]
+        job = GenerationJob(job_type, params, priority)
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            self.condition.notify()
+        return job
+
+    def submit_imagine(self, prompt):
+        return self.submit("imagine", prompt=prompt)
+
+    def submit_upscale(self, message_id, index, button_custom_id):
+        return self.submit("upscale", message_id=message_id, index=index,
+                           button_custom_id=button_custom_id)
+
+    def submit_variation(self, message_id, index):
+        return self.submit("variation", message_id=message_id, index=index)
+
+    def _run(self):
+        """Riempie gli slot liberi con i job a priorità più alta"""
+        while True:
+            with self.condition:
+                while self.running and not self._can_dispatch():
+                    self._expire_stale_jobs()
+                    self.condition.wait(timeout=self._next_wakeup())
+                if not self.running:
+                    return
+                _, _, job = heapq.heappop(self.queue)
+                job.status = "running"
+                job.started_at = time.monotonic()
+                job.attempts += 1
+                job.nonce = self.discord_client.generate_nonce()
+                self.in_flight[job.job_id] = job
+
+            # Il nonce lega l'interazione inviata al messaggio risultato
+            self.discord_client.message_tracker.track_interaction(
+                job.nonce,
+                job.type,
+                original_id=job.params.get("message_id"),
+                data={"job_id": job.job_id, **job.params}
+            )
+
+            if not self._dispatch(job):
+                self._retry_or_fail(job)
+
+    def _can_dispatch(self):
+        """Sessione pronta, un job in coda e uno slot libero"""
+        self._release_delayed()
+        return self.session_ready and self.queue and len(self.in_flight) < self.max_slots
+
+    def _release_delayed(self):
+        """Rimette in coda i job il cui backoff è scaduto"""
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self.delayed)
+            heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+
+    def _next_wakeup(self):
+        """Attesa massima prima di ricontrollare backoff e timeout"""
+        if self.delayed:
+            return min(5, max(0, self.delayed[0][0] - time.monotonic()))
+        return 5
+
+    def _dispatch(self, job):
+        """Invia il comando Discord corrispondente al job"""
+        try:
+            channel_id = self.app.config["CHANNEL_ID"]
+            guild_id = self.app.config["GUILD_ID"]
+            params = job.params
+
+            if job.type == "imagine":
+                return self.discord_client.send_imagine_command(
+                    channel_id, guild_id, params["prompt"], nonce=job.nonce)
+            if job.type == "upscale":
+                return self.discord_client.send_upscale_command(
+                    channel_id, guild_id, params["message_id"], params["index"],
+                    params["button_custom_id"], nonce=job.nonce)
+            if job.type == "variation":
+                return self.discord_client.send_variation_command(
+                    channel_id, guild_id, params["message_id"], params["index"],
+                    nonce=job.nonce)
+            return False
+
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Job dispatch failed: {str(e)}")
+            return False
+
+    def _retry_or_fail(self, job):
+        """Rimette in coda un job fallito o lo segna come fallito"""
+        self.discord_client.message_tracker.update_status(job.nonce, "failed")
+        with self.condition:
+            self.in_flight.pop(job.job_id, None)
+            job.status = "queued"
+            if not self.session_ready:
+                # Sessione caduta durante l'invio: il tentativo non conta, si riparte a READY/RESUMED
+                job.attempts -= 1
+                heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+            elif job.attempts < self.max_attempts:
+                # Backoff esponenziale con jitter prima del prossimo tentativo
+                delay = min(self.max_retry_delay, self.base_retry_delay * (2 ** (job.attempts - 1)))
+                not_before = time.monotonic() + random.uniform(delay / 2, delay)
+                heapq.heappush(self.delayed, (not_before, next(self.counter), job))
+            else:
+                job.status = "failed"
+                self.app.log_message(f"[ERROR] Job {job.type} failed after {job.attempts} attempts")
+            self.condition.notify()
+
+    def _expire_stale_jobs(self):
+        """Libera gli slot dei job senza risultato oltre il timeout"""
+        now = time.monotonic()
+        for job_id, job in list(self.in_flight.items()):
+            if now - job.started_at > self.job_timeout:
+                del self.in_flight[job_id]
+                job.status = "timed_out"
+                self.app.log_message(f"[ERROR] Job {job.type} timed out, slot released")
+
+    def _match_job(self, message_data):
+        """Trova il job in esecuzione per un messaggio che il tracker non ha correlato"""
+        content = message_data.get("content", "")
+        reference = (message_data.get("message_reference") or {}).get("message_id")
+        imagines = []
+
+        for job in sorted(self.in_flight.values(), key=lambda j: j.started_at):
+            if job.type == "imagine":
+                if reference:
+                    continue
+                if job.params["prompt"].strip() in content:
+                    return job
+                imagines.append(job)
+            elif reference and str(job.params["message_id"]) == str(reference):
+                is_upscale = f"Image #{job.params['index']}" in content
+                if (job.type == "upscale") == is_upscale:
+                    return job
+
+        # Prompt riscritto da Midjourney: attribuibile solo se c'è un unico imagine in volo
+        if not reference and len(imagines) == 1:
+            return imagines[0]
+        return None
+
+    def on_result(self, message_data):
+        """Libera lo slot del job quando arriva il MESSAGE_CREATE risultato"""
+        tracker = self.discord_client.message_tracker
+        record = tracker.resolve_message(message_data)
+
+        with self.condition:
+            # Con un record (nonce, interazione, prompt) il job è quello: niente euristiche
+            if record:
+                job = self.in_flight.get(record["data"].get("job_id"))
+            else:
+                job = self._match_job(message_data)
+            if job is None:
+                if record and record["status"] == "pending":
+                    # Job inviato prima di un riavvio: riconciliato dal journal
+                    tracker.update_status(record["record_id"], "completed",
+                                          {"result_message_id": message_data.get("id")})
+                return None
+
+            del self.in_flight[job.job_id]
+            job.status = "completed"
+            job.result_message_id = message_data.get("id")
+            self.condition.notify()
+
+        if record is None:
+            # Correlazione euristica: il messaggio viene agganciato al job
+            tracker.link_message(job.nonce, job.result_message_id)
+        tracker.update_status(job.nonce, "completed", {"result_message_id": job.result_message_id})
+        return job
@@ -0,0 +1,40 @@
+import re
+import time
+import threading
+
+PROGRESS_PATTERN = re.compile(r"\((\d{1,3})%\)")
+
+
+def parse_progress(message_data):
+    """Estrae percentuale e URL dell'anteprima da un MESSAGE_UPDATE di Midjourney"""
+    match = PROGRESS_PATTERN.search(message_data.get("content") or "")
+    if not match:
+        return None, None
+
+    preview_url = None
+    for attachment in message_data.get("attachments") or []:
+        preview_url = attachment.get("url")
+        if preview_url:
+            break
+
+    return min(int(match.group(1)), 100), preview_url
+
+
+class ProgressCoalescer:
+    def __init__(self):
+        """Tiene solo l'ultimo aggiornamento per job fino al prossimo frame della UI"""
+        self.latest = {}
+        self.lock = threading.Lock()
+
+    def push(self, job_key, update):
+        """Registra un aggiornamento, sostituendo quello non ancora consegnato"""
+        update["updated_at"] = time.monotonic()
+        with self.lock:
+            self.latest[job_key] = update
+
+    def drain(self):
+        """Consegna al thread Qt gli aggiornamenti accumulati dall'ultimo frame"""
+        with self.lock:
+            updates = self.latest
+            self.latest = {}
+        return updates
@@ -0,0 +1,69 @@
+import os
+import re
+import json
+
+DEFAULT_TAXONOMY = os.path.join(os.path.dirname(__file__), "category_taxonomy.json")
+
+# Parametri Midjourney estratti nella stessa scansione (alias -> nome)
+PROMPT_PARAMETERS = {
+    "sref": "sref",
+    "aspect": "ar",
+    "ar": "ar",
+    "version": "v",
+    "v": "v",
+    "style": "style"
+}
+
+
+class PromptClassifier:
+    def __init__(self, app_reference):
+        """Classificatore categorie + parametri compilato in un'unica regex"""
+        self.app = app_reference
+        self.taxonomy = self.load_taxonomy()
+        self.keyword_categories = {}
+        for category, keywords in self.taxonomy.items():
+            for keyword in keywords:
+                self.keyword_categories.setdefault(keyword.lower(), []).append(category)
+        self.category_order = {category: index for index, category in enumerate(self.taxonomy)}
+        self.pattern = self.compile_pattern()
+
+    def load_taxonomy(self):
+        """Tassonomia da system_dir se presente, altrimenti quella di default"""
+        custom_file = os.path.join(self.app.system_dir, "category_taxonomy.json")
+        for taxonomy_file in (custom_file, DEFAULT_TAXONOMY):
+            try:
+                if os.path.exists(taxonomy_file):
+                    with open(taxonomy_file, 'r', encoding='utf-8') as f:
+                        return json.load(f)
+            except Exception as e:
+                self.app.log_message(f"[ERROR] Failed to load taxonomy {taxonomy_file}: {str(e)}")
+        return {}
+
+    def compile_pattern(self):
+        """Un'unica alternanza: parametri e parole chiave, in lookahead per le sovrapposizioni"""
+        parameters = "|".join(sorted(PROMPT_PARAMETERS, key=len, reverse=True))
+        alternatives = [rf"(?P<param>--(?P<name>{parameters})\s+(?P<value>[^\s*-][^\s*]*))"]
+        if self.keyword_categories:
+            # Parole più lunghe prima: "fine art" vince su "art" nella stessa posizione
+            keywords = sorted(self.keyword_categories, key=len, reverse=True)
+            alternatives.append("(?P<keyword>" + "|".join(re.escape(k) for k in keywords) + ")")
+        return re.compile("(?=" + "|".join(alternatives) + ")", re.IGNORECASE)
+
+    def classify(self, content):
+        """Ritorna categorie con punteggio e parametri del prompt in una sola passata"""
+        scores = {}
+        parameters = {}
+
+        for match in self.pattern.finditer(content or ""):
+            if match.group("param"):
+                name = PROMPT_PARAMETERS[match.group("name").lower()]
+                parameters.setdefault(name, match.group("value"))
+            else:
+                for category in self.keyword_categories[match.group("keyword").lower()]:
+                    scores[category] = scores.get(category, 0) + 1
+
+        categories = sorted(
+            scores.items(),
+            key=lambda item: (-item[1], self.category_order[item[0]])
+        )
+        return {"categories": categories, "parameters": parameters}
@@ -0,0 +1,63 @@
+import os
+import re
+import json
+import threading
+
+
+class SequenceAllocator:
+    def __init__(self, app_reference):
+        """Numerazione progressiva dei file per cartella, senza glob ad ogni salvataggio"""
+        self.app = app_reference
+        self.state_file = os.path.join(app_reference.system_dir, "sequence_state.json")
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.load_state()
+
+    def load_state(self):
+        """Carica gli ultimi numeri assegnati"""
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    self.counters = json.load(f)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to load sequence state: {str(e)}")
+            self.counters = {}
+
+    def save_state(self):
+        """Salva i contatori su disco in modo atomico"""
+        try:
+            temp_file = f"{self.state_file}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.counters, f)
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            self.app.log_message(f"[ERROR] Failed to save sequence state: {str(e)}")
+
+    def scan(self, directory, prefix, extension):
+        """Unica scansione della cartella: numero più alto già usato"""
+        pattern = re.compile(rf"^{re.escape(prefix)}(\d+){re.escape(extension)}$")
+        highest = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = pattern.match(entry.name)
+                if match:
+                    highest = max(highest, int(match.group(1)))
+        return highest
+
+    def allocate(self, directory, prefix, extension=".png"):
+        """Riserva il prossimo percorso libero per prefisso e cartella"""
+        key = f"{os.path.normpath(directory)}|{prefix}|{extension}"
+        with self.lock:
+            if key not in self.counters:
+                os.makedirs(directory, exist_ok=True)
+                self.counters[key] = self.scan(directory, prefix, extension)
+
+            # Se lo stato salvato è indietro rispetto al disco si avanza
+            while True:
+                self.counters[key] += 1
+                path = os.path.join(directory, f"{prefix}{self.counters[key]:03d}{extension}")
+                if not os.path.exists(path):
+                    break
+
+            self.save_state()
+            return path
@@ -0,0 +1,33 @@
+import os
+import threading
+
+
+class TokenUsage:
+    def __init__(self, app_reference):
+        """Token di input e output consumati dalle analisi"""
+        self.app = app_reference
+        self.lock = threading.Lock()
+        self.totals = {
+            "calls": 0,
+            "input": 0,
+            "output": 0
+        }
+
+    def record_usage(self, image_path, usage):
+        """Registra e logga i token di una chiamata (usage della risposta Messages API)"""
+        counts = {
+            "input": usage.input_tokens or 0,
+            "output": usage.output_tokens or 0
+        }
+        with self.lock:
+            self.totals["calls"] += 1
+            for name, value in counts.items():
+                self.totals[name] += value
+        self.app.log_message(
+            f"[INFO] Tokens for {os.path.basename(image_path)}: "
+            f"{counts['input']} input, {counts['output']} output"
+        )
+
+    def get_usage(self):
+        with self.lock:
+            return dict(self.totals)
@@ -0,0 +1,249 @@
+"""Servizio Anthropic finto per provare le analisi senza rete.
+
+Implementa POST /v1/messages e la Message Batches API (creazione, stato,
+risultati .jsonl) con tempi di elaborazione e fallimenti parziali configurabili.
+
+Avvio (dalla cartella src):
+    python -m utils.fake_anthropic --port 8766 --batch-duration 20 --failure-ratio 0.1
+
+Nel config dell'app: "ANTHROPIC_BASE_URL": "http://127.0.0.1:8766".
+"""
+import json
+import time
+import random
+import uuid
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS_TEXT = """PATTERN ANALYSIS:
+Layered diagonal forms with a fine grain texture ({seed}).
+
+CREATIVE INTERPRETATION:
+A coastal city at dusk seen through rain on glass.
+
+COLOR ANALYSIS:
+(32, 44, 71), (201, 122, 64), (240, 214, 170), (90, 110, 140), (18, 18, 22)
+
+TECHNICAL NOTES:
+Low angle, 35mm, backlit with warm rim light.
+
+PROMPT 1:
+Rain-streaked window over a coastal city at dusk, 35mm, backlit, cinematic
+
+PROMPT 2:
+Dreamlike coastal city dissolving into amber rain, painterly, layered glass"""
+
+IMAGE_TOKENS = 1600  # costo fisso stimato per immagine
+
+
+@dataclass
+class FakeAnthropicConfig:
+    host: str = "127.0.0.1"
+    port: int = 8766
+    message_latency: float = 1.0  # secondi per POST /v1/messages
+    batch_duration: float = 10.0  # secondi prima che un batch risulti "ended"
+    failure_ratio: float = 0.0  # richieste del batch che finiscono in errored
+    expire_ratio: float = 0.0  # richieste del batch che finiscono in expired
+
+
+def rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeAnthropicServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config):
+        super().__init__((config.host, config.port), FakeAnthropicHandler)
+        self.config = config
+        self.base_url = f"http://{config.host}:{self.server_address[1]}"
+        self.batches = {}  # id -> {created, requests, outcomes}
+        self.lock = threading.Lock()
+        self.counters = {
+            "messages": 0,
+            "batches": 0,
+            "batch_requests": 0,
+            "errored": 0,
+            "expired": 0
+        }
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    @staticmethod
+    def block_tokens(block):
+        """Stima grossolana: ~4 caratteri per token, costo fisso per le immagini"""
+        if block.get("type") == "image":
+            return IMAGE_TOKENS
+        return max(1, len(block.get("text", "")) // 4)
+
+    def input_tokens(self, params):
+        """Token di input stimati sui blocchi dei messaggi"""
+        return sum(
+            self.block_tokens(block)
+            for message in params.get("messages", [])
+            for block in (message["content"] if isinstance(message["content"], list)
+                          else [{"type": "text", "text": message["content"]}])
+        )
+
+    def message(self, params, seed):
+        """Risposta Messages API con un'analisi nel formato atteso da parse_response"""
+        text = ANALYSIS_TEXT.format(seed=seed)
+        return {
+            "id": f"msg_{hashlib.md5(seed.encode()).hexdigest()[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": params.get("model", "claude"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": self.input_tokens(params), "output_tokens": len(text) // 4}
+        }
+
+    def create_batch(self, requests):
+        """Decide subito l'esito di ogni richiesta; diventa visibile a fine elaborazione"""
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        outcomes = {}
+        for request in requests:
+            roll = random.random()
+            if roll < self.config.failure_ratio:
+                outcomes[request["custom_id"]] = "errored"
+            elif roll < self.config.failure_ratio + self.config.expire_ratio:
+                outcomes[request["custom_id"]] = "expired"
+            else:
+                outcomes[request["custom_id"]] = "succeeded"
+        with self.lock:
+            self.batches[batch_id] = {"created": time.time(), "requests": requests, "outcomes": outcomes}
+            self.counters["batches"] += 1
+            self.counters["batch_requests"] += len(requests)
+        return self.batch_object(batch_id)
+
+    def batch_object(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+
+        ended = time.time() - batch["created"] >= self.config.batch_duration
+        outcomes = list(batch["outcomes"].values())
+        counts = {"processing": 0 if ended else len(outcomes), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        if ended:
+            for outcome in outcomes:
+                counts[outcome] += 1
+
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": counts,
+            "created_at": rfc3339(batch["created"]),
+            "expires_at": rfc3339(batch["created"] + timedelta(hours=24).total_seconds()),
+            "ended_at": rfc3339(batch["created"] + self.config.batch_duration) if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.base_url}/v1/messages/batches/{batch_id}/results" if ended else None
+        }
+
+    def batch_results(self, batch_id):
+        """Righe .jsonl, in ordine diverso da quello di invio come il servizio reale"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        lines = []
+        for request in batch["requests"]:
+            custom_id = request["custom_id"]
+            outcome = batch["outcomes"][custom_id]
+            if outcome == "succeeded":
+                result = {"type": "succeeded", "message": self.message(request["params"], f"{batch_id}/{custom_id}")}
+            elif outcome == "errored":
+                self.count("errored")
+                result = {"type": "errored", "error": {
+                    "type": "error",
+                    "error": {"type": "overloaded_error", "message": "Overloaded"}
+                }}
+            else:
+                self.count("expired")
+                result = {"type": "expired"}
+            lines.append(json.dumps({"custom_id": custom_id, "result": result}))
+        random.shuffle(lines)
+        return "\n".join(lines) + "\n"
+
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, data, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, body):
+        self.send_body(status, json.dumps(body).encode())
+
+    def not_found(self):
+        self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if path == "/v1/messages":
+            self.server.count("messages")
+            time.sleep(self.server.config.message_latency)
+            self.send_json(200, self.server.message(body, str(time.time())))
+        elif path == "/v1/messages/batches":
+            self.send_json(200, self.server.create_batch(body.get("requests", [])))
+        else:
+            self.not_found()
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if parts[:3] != ["v1", "messages", "batches"] or len(parts) < 4:
+            if parts == ["stats"]:
+                with self.server.lock:
+                    return self.send_json(200, dict(self.server.counters))
+            return self.not_found()
+
+        batch = self.server.batch_object(parts[3])
+        if batch is None:
+            return self.not_found()
+        if len(parts) == 5 and parts[4] == "results":
+            if batch["processing_status"] != "ended":
+                return self.send_json(400, {"type": "error", "error": {
+                    "type": "invalid_request_error", "message": "Batch is still processing"
+                }})
+            return self.send_body(200, self.server.batch_results(parts[3]).encode(), "application/x-jsonl")
+        self.send_json(200, batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Anthropic Messages/Message Batches stand-in")
+    defaults = FakeAnthropicConfig()
+    for name, value in vars(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    config = FakeAnthropicConfig(**vars(parser.parse_args()))
+
+    server = FakeAnthropicServer(config)
+    print(f"Fake Anthropic listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with server.lock:
+            print(json.dumps(server.counters, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,650 @@
+"""Servizio Discord finto per benchmark end-to-end di DiscordClient.
+
+Implementa l'handshake del gateway (HELLO/IDENTIFY/READY/ACK/RESUME), gli
+endpoint REST usati dal client, la CDN degli allegati e un Midjourney simulato
+che risponde ai comandi con MESSAGE_CREATE/MESSAGE_UPDATE.
+
+Avvio (dalla cartella src):
+    python -m utils.fake_discord --port 8765 --job-duration 5 --rate-limit-ratio 0.05
+
+Nel config dell'app: "DISCORD_API_URL": "http://127.0.0.1:8765/api/v9".
+Le statistiche lato server sono su http://127.0.0.1:8765/stats.
+"""
+import os
+import json
+import time
+import zlib
+import heapq
+import base64
+import random
+import struct
+import socket
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MIDJOURNEY_ID = "936929561302675456"
+COMMAND_VERSION = "1237876415471554623"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def form_error(field, code, message):
+    """Corpo di un 400 "Invalid Form Body" come lo restituisce Discord"""
+    return {
+        "message": "Invalid Form Body",
+        "code": 50035,
+        "errors": {field: {"_errors": [{"code": code, "message": message}]}}
+    }
+
+
+@dataclass
+class FakeDiscordConfig:
+    host: str = "127.0.0.1"
+    port: int = 8765
+    heartbeat_interval: int = 41250  # ms
+    rest_latency: float = 0.0  # secondi aggiunti a ogni risposta REST
+    dispatch_latency: float = 0.0  # secondi prima dell'INTERACTION_CREATE
+    job_duration: float = 5.0  # secondi da interazione a risultato
+    progress_steps: int = 3  # MESSAGE_UPDATE con percentuale per job
+    image_size: int = 1024  # lato in pixel delle immagini generate
+    rate_limit: int = 5  # interazioni per finestra prima del 429
+    rate_limit_window: float = 5.0
+    rate_limit_ratio: float = 0.0  # 429 casuali oltre al bucket
+    disconnect_interval: float = 0.0  # media in secondi tra disconnessioni (0 = mai)
+    drop_ack_ratio: float = 0.0  # heartbeat senza ACK (connessione zombie)
+    cdn_failure_ratio: float = 0.0  # download interrotti a metà
+    cdn_bandwidth: int = 0  # byte/s per connessione CDN (0 = illimitata)
+
+
+class FakeMidjourneyImages:
+    def __init__(self, size):
+        """PNG di rumore generati una volta; ogni job aggiunge un chunk che lo rende unico"""
+        self.size = size
+        self.body = self.build_body(size)
+
+    @staticmethod
+    def chunk(kind, data):
+        return (struct.pack("!I", len(data)) + kind + data
+                + struct.pack("!I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def build_body(self, size):
+        rows = b"".join(b"\x00" + os.urandom(size * 3) for _ in range(size))
+        header = struct.pack("!IIBBBBB", size, size, 8, 2, 0, 0, 0)
+        return (self.chunk(b"IHDR", header)
+                + self.chunk(b"IDAT", zlib.compress(rows, 1)))
+
+    def render(self, job_id):
+        """PNG completo per un job (contenuto diverso per ogni job)"""
+        return (b"\x89PNG\r\n\x1a\n" + self.body
+                + self.chunk(b"tEXt", b"job\x00" + job_id.encode())
+                + self.chunk(b"IEND", b""))
+
+
+class GatewaySession:
+    def __init__(self, session_id):
+        """Stato ripristinabile di una sessione: sequenza e eventi inviati"""
+        self.session_id = session_id
+        self.sequence = 0
+        self.backlog = []  # (seq, payload) per il RESUME
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def dispatch(self, event_type, data):
+        """Numera l'evento e lo invia se la sessione è connessa"""
+        with self.lock:
+            self.sequence += 1
+            # t e s prima di d, come il vero gateway (EventFilter ci conta)
+            payload = json.dumps(
+                {"op": 0, "t": event_type, "s": self.sequence, "d": data},
+                separators=(",", ":")
+            )
+            self.backlog.append((self.sequence, payload))
+            del self.backlog[:-1000]
+            connection = self.connection
+        if connection:
+            connection.send_payload(payload)
+
+    def replay(self, connection, last_sequence):
+        """Rinvia gli eventi persi dopo last_sequence e aggancia la connessione"""
+        with self.lock:
+            missed = [payload for seq, payload in self.backlog if seq > (last_sequence or 0)]
+            self.connection = connection
+        for payload in missed:
+            connection.send_payload(payload)
+        return len(missed)
+
+
+class GatewayConnection:
+    def __init__(self, server, handler, compress):
+        """Connessione WebSocket (RFC 6455) del gateway su un handler HTTP"""
+        self.server = server
+        self.handler = handler
+        self.compress = compress
+        self.compressor = zlib.compressobj() if compress else None
+        self.send_lock = threading.Lock()
+        self.session = None
+        self.closed = False
+
+    def send_frame(self, opcode, payload):
+        with self.send_lock:
+            self._write_frame(opcode, payload)
+
+    def _write_frame(self, opcode, payload):
+        """Scrive un frame (chiamata con send_lock)"""
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 65536:
+            header += bytes([126]) + struct.pack("!H", length)
+        else:
+            header += bytes([127]) + struct.pack("!Q", length)
+        if self.closed:
+            return
+        try:
+            self.handler.wfile.write(header + payload)
+        except OSError:
+            self.closed = True
+
+    def send_payload(self, payload):
+        """Invia un payload JSON, compresso con zlib-stream se richiesto"""
+        # Compressione e scrittura sotto lo stesso lock: il contesto zlib è ordinato
+        with self.send_lock:
+            if self.compress:
+                data = self.compressor.compress(payload.encode()) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+                self._write_frame(0x2, data)
+            else:
+                self._write_frame(0x1, payload.encode())
+
+    def send_op(self, op, data=None):
+        self.send_payload(json.dumps({"op": op, "d": data}, separators=(",", ":")))
+
+    def close(self, code=1000, reason=""):
+        """Chiude con un close code (4000 = ripristinabile)"""
+        self.send_frame(0x8, struct.pack("!H", code) + reason.encode())
+        with self.send_lock:
+            self.closed = True
+        try:
+            self.handler.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def read_message(self):
+        """Legge un messaggio completo (ricompone i frame frammentati)"""
+        message = bytearray()
+        while True:
+            head = self.handler.rfile.read(2)
+            if len(head) < 2:
+                return None, None
+            fin = head[0] & 0x80
+            opcode = head[0] & 0x0f
+            length = head[1] & 0x7f
+            if length == 126:
+                length = struct.unpack("!H", self.handler.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self.handler.rfile.read(8))[0]
+            mask = self.handler.rfile.read(4) if head[1] & 0x80 else None
+            payload = bytearray(self.handler.rfile.read(length))
+            if mask:
+                for index in range(len(payload)):
+                    payload[index] ^= mask[index % 4]
+
+            if opcode == 0x9:  # Ping
+                self.send_frame(0xA, bytes(payload))
+                continue
+            if opcode == 0x8:  # Close
+                return 0x8, bytes(payload)
+            message.extend(payload)
+            if fin:
+                return opcode, bytes(message)
+
+    def run(self):
+        """Ciclo del gateway: HELLO, poi IDENTIFY/RESUME e heartbeat"""
+        self.send_op(10, {"heartbeat_interval": self.server.config.heartbeat_interval})
+        disconnect_timer = self.server.schedule_disconnect(self)
+        try:
+            while not self.closed:
+                opcode, message = self.read_message()
+                if opcode is None or opcode == 0x8:
+                    break
+                self.handle(json.loads(message))
+        except (OSError, ValueError):
+            pass
+        finally:
+            if disconnect_timer:
+                disconnect_timer.cancel()
+            with self.send_lock:
+                self.closed = True
+            if self.session and self.session.connection is self:
+                self.session.connection = None
+
+    def handle(self, data):
+        op = data.get("op")
+        if op == 1:  # Heartbeat
+            self.server.count("heartbeats")
+            if random.random() >= self.server.config.drop_ack_ratio:
+                self.send_op(11)
+        elif op == 2:  # Identify
+            self.server.count("identifies")
+            self.session = self.server.new_session()
+            self.session.replay(self, self.session.sequence)
+            self.session.dispatch("READY", {
+                "v": 9,
+                "session_id": self.session.session_id,
+                "resume_gateway_url": self.server.gateway_url,
+                "user": {"id": "1", "username": "benchmark"}
+            })
+        elif op == 6:  # Resume
+            session = self.server.sessions.get(data["d"].get("session_id"))
+            if session is None:
+                self.server.count("invalid_sessions")
+                self.send_op(9, False)
+                return
+            self.server.count("resumes")
+            self.session = session
+            replayed = session.replay(self, data["d"].get("seq"))
+            self.server.count("replayed_events", replayed)
+            session.dispatch("RESUMED", {})
+
+
+class FakeMidjourney:
+    def __init__(self, server):
+        """Genera i messaggi di Midjourney per imagine, upscale e variation"""
+        self.server = server
+        self.config = server.config
+        self.images = FakeMidjourneyImages(server.config.image_size)
+        self.jobs = {}  # hash del job -> prompt
+        self.timeline = []  # heap di (istante, contatore, callback)
+        self.counter = 0
+        self.condition = threading.Condition()
+        threading.Thread(target=self._run_timeline, daemon=True).start()
+
+    def snowflake(self):
+        return str((int(time.time() * 1000) - 1420070400000) << 22 | random.getrandbits(22))
+
+    def at(self, delay, callback):
+        """Pianifica un evento senza un thread per job"""
+        with self.condition:
+            self.counter += 1
+            heapq.heappush(self.timeline, (time.monotonic() + delay, self.counter, callback))
+            self.condition.notify()
+
+    def _run_timeline(self):
+        while True:
+            with self.condition:
+                while not self.timeline or self.timeline[0][0] > time.monotonic():
+                    timeout = self.timeline[0][0] - time.monotonic() if self.timeline else None
+                    self.condition.wait(timeout)
+                _, _, callback = heapq.heappop(self.timeline)
+            try:
+                callback()
+            except Exception as e:
+                print(f"[ERROR] Fake Midjourney event failed: {str(e)}")
+
+    def message(self, channel_id, content, **fields):
+        message = {
+            "id": fields.pop("id", None) or self.snowflake(),
+            "channel_id": channel_id,
+            "author": {"id": MIDJOURNEY_ID, "username": "Midjourney Bot", "bot": True},
+            "content": content,
+            "attachments": [],
+            "components": []
+        }
+        message.update(fields)
+        return message
+
+    def attachment(self, channel_id, job_hash, suffix=""):
+        """Registra l'immagine del job sulla CDN e ritorna l'allegato"""
+        attachment_id = self.snowflake()
+        filename = f"benchmark_{job_hash}{suffix}.png"
+        body = self.images.render(f"{job_hash}{suffix}")
+        self.server.store_attachment(f"/attachments/{channel_id}/{attachment_id}/{filename}", body)
+        return {
+            "id": attachment_id,
+            "filename": filename,
+            "size": len(body),
+            "url": f"{self.server.http_url}/attachments/{channel_id}/{attachment_id}/{filename}",
+            "proxy_url": f"{self.server.http_url}/attachments/{channel_id}/{attachment_id}/{filename}",
+            "width": self.config.image_size,
+            "height": self.config.image_size,
+            "content_type": "image/png"
+        }
+
+    @staticmethod
+    def grid_components(job_hash):
+        return [
+            {"type": 1, "components": [
+                {"type": 2, "custom_id": f"MJ::JOB::upsample::{index}::{job_hash}", "label": f"U{index}"}
+                for index in range(1, 5)
+            ] + [{"type": 2, "custom_id": f"MJ::JOB::reroll::0::{job_hash}::SOLO"}]},
+            {"type": 1, "components": [
+                {"type": 2, "custom_id": f"MJ::JOB::variation::{index}::{job_hash}", "label": f"V{index}"}
+                for index in range(1, 5)
+            ]}
+        ]
+
+    def start_job(self, session, payload):
+        """Simula un job: INTERACTION_CREATE, avanzamento e risultato"""
+        channel_id = payload["channel_id"]
+        interaction_id = self.snowflake()
+        nonce = payload.get("nonce")
+        job_hash = hashlib.md5(f"{interaction_id}{nonce}".encode()).hexdigest()[:16]
+        data = payload.get("data", {})
+
+        if payload.get("type") == 2:
+            prompt = next((o["value"] for o in data.get("options", []) if o["name"] == "prompt"), "")
+            kind, index, reference = "imagine", None, None
+        else:
+            # MJ::JOB::<azione>::<indice>::<hash del job padre>
+            parts = data.get("custom_id", "").split("::")
+            kind = "upscale" if parts[2].startswith("upsample") else "variation"
+            index = parts[3]
+            prompt = self.jobs.get(parts[4], "unknown prompt")
+            reference = payload.get("message_id")
+        self.jobs[job_hash] = prompt
+
+        progress_id = self.snowflake()
+        latency = self.config.dispatch_latency
+        self.at(latency, lambda: session.dispatch("INTERACTION_CREATE", {
+            "id": interaction_id, "nonce": nonce, "type": payload.get("type")
+        }))
+        self.at(latency, lambda: session.dispatch("INTERACTION_SUCCESS", {
+            "id": interaction_id, "nonce": nonce
+        }))
+        if kind != "upscale":
+            self.at(latency, lambda: session.dispatch("MESSAGE_CREATE", self.message(
+                channel_id, f"**{prompt}** - <@1> (Waiting to start)",
+                id=progress_id, nonce=nonce,
+                interaction_metadata={"id": interaction_id}
+            )))
+            steps = max(1, self.config.progress_steps)
+            for step in range(1, steps + 1):
+                percent = int(100 * step / (steps + 1))
+                self.at(latency + self.config.job_duration * step / (steps + 1),
+                        lambda percent=percent, step=step: session.dispatch("MESSAGE_UPDATE", self.message(
+                            channel_id, f"**{prompt}** - <@1> ({percent}%) (fast)",
+                            id=progress_id,
+                            attachments=[self.attachment(channel_id, job_hash, f"_preview{step}")]
+                        )))
+
+        def complete():
+            if kind != "upscale":
+                session.dispatch("MESSAGE_DELETE", {"id": progress_id, "channel_id": channel_id})
+            if kind == "upscale":
+                content = f"**{prompt}** - Image #{index} <@1>"
+                components = [{"type": 1, "components": [
+                    {"type": 2, "custom_id": f"MJ::JOB::high_variation::1::{job_hash}::SOLO"},
+                    {"type": 2, "custom_id": f"MJ::JOB::low_variation::1::{job_hash}::SOLO"}
+                ]}]
+            else:
+                label = " - Variations (Strong) by" if kind == "variation" else " -"
+                content = f"**{prompt}**{label} <@1> (fast)"
+                components = self.grid_components(job_hash)
+            fields = {"message_reference": {"message_id": reference}} if reference else {}
+            session.dispatch("MESSAGE_CREATE", self.message(
+                channel_id, content,
+                attachments=[self.attachment(channel_id, job_hash)],
+                components=components,
+                **fields
+            ))
+            self.server.count("jobs_completed")
+
+        self.at(latency + self.config.job_duration, complete)
+
+
+class FakeDiscordServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config):
+        """Gateway, REST e CDN sullo stesso host:porta"""
+        super().__init__((config.host, config.port), FakeDiscordHandler)
+        self.config = config
+        self.http_url = f"http://{config.host}:{self.server_address[1]}"
+        self.gateway_url = f"ws://{config.host}:{self.server_address[1]}"
+        self.sessions = {}
+        self.attachments = {}  # path -> bytes
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.started_at = time.monotonic()
+        self.counters = {
+            "identifies": 0,
+            "resumes": 0,
+            "invalid_sessions": 0,
+            "replayed_events": 0,
+            "heartbeats": 0,
+            "disconnects": 0,
+            "interactions": 0,
+            "rate_limited": 0,
+            "jobs_completed": 0,
+            "cdn_requests": 0,
+            "cdn_ranges": 0,
+            "cdn_failures": 0,
+            "cdn_bytes": 0
+        }
+        self.midjourney = FakeMidjourney(self)
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def new_session(self):
+        session = GatewaySession(hashlib.md5(os.urandom(16)).hexdigest())
+        with self.lock:
+            self.sessions[session.session_id] = session
+        return session
+
+    def schedule_disconnect(self, connection):
+        """Chiude la connessione dopo un intervallo casuale (close 4000, ripristinabile)"""
+        if not self.config.disconnect_interval:
+            return None
+
+        def disconnect():
+            self.count("disconnects")
+            if random.random() < 0.5:
+                connection.send_op(7)  # Reconnect richiesto dal gateway
+            else:
+                connection.close(4000, "Unknown error")
+
+        timer = threading.Timer(random.expovariate(1 / self.config.disconnect_interval), disconnect)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def store_attachment(self, path, body):
+        with self.lock:
+            self.attachments[path] = body
+
+    def take_rate_limit(self):
+        """Bucket a finestra fissa per /interactions: (ammesso, rimanenti, reset_after)"""
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.config.rate_limit_window:
+                self.window_start = now
+                self.window_count = 0
+            reset_after = self.config.rate_limit_window - (now - self.window_start)
+            if self.window_count >= self.config.rate_limit or random.random() < self.config.rate_limit_ratio:
+                self.counters["rate_limited"] += 1
+                return False, 0, reset_after
+            self.window_count += 1
+            return True, self.config.rate_limit - self.window_count, reset_after
+
+    def get_stats(self):
+        """Contatori lato server con throughput per minuto"""
+        with self.lock:
+            stats = dict(self.counters)
+        elapsed = time.monotonic() - self.started_at
+        stats["uptime"] = round(elapsed, 1)
+        stats["jobs_per_minute"] = round(stats["jobs_completed"] / elapsed * 60, 2) if elapsed else 0
+        stats["cdn_mb_per_second"] = round(stats["cdn_bytes"] / elapsed / 1e6, 3) if elapsed else 0
+        return stats
+
+
+class FakeDiscordHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Un log per richiesta falserebbe il benchmark
+        pass
+
+    def send_json(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            return self.upgrade(url)
+        if url.path.startswith("/attachments/"):
+            return self.serve_attachment(url.path)
+
+        time.sleep(self.server.config.rest_latency)
+        if url.path == "/api/v9/gateway":
+            self.send_json(200, {"url": self.server.gateway_url})
+        elif url.path == f"/api/v9/applications/{MIDJOURNEY_ID}/commands":
+            self.send_json(200, [
+                {"id": "938956540159881230", "version": COMMAND_VERSION, "name": name, "type": 1}
+                for name in ("imagine", "describe", "blend", "settings")
+            ])
+        elif url.path == "/stats":
+            self.send_json(200, self.server.get_stats())
+        else:
+            self.send_json(404, {"message": "404: Not Found", "code": 0})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        time.sleep(self.server.config.rest_latency)
+
+        if url.path != "/api/v9/interactions":
+            return self.send_json(404, {"message": "404: Not Found", "code": 0})
+
+        self.server.count("interactions")
+        allowed, remaining, reset_after = self.server.take_rate_limit()
+        headers = {
+            "X-RateLimit-Limit": str(self.server.config.rate_limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Bucket": "a06de2f2c3d1e4b5"
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, int(reset_after + 0.999)))
+            return self.send_json(429, {
+                "message": "You are being rate limited.",
+                "retry_after": round(reset_after, 3),
+                "global": False
+            }, headers)
+
+        payload = json.loads(body or b"{}")
+        session = self.server.sessions.get(payload.get("session_id"))
+        if session is None:
+            return self.send_json(400, form_error(
+                "session_id", "INTERACTION_UNKNOWN_SESSION", "Unknown session"
+            ), headers)
+        if payload.get("type") == 2 and payload.get("data", {}).get("version") != COMMAND_VERSION:
+            return self.send_json(400, form_error(
+                "data", "INTERACTION_APPLICATION_COMMAND_INVALID_VERSION",
+                "This command is outdated, please try again in a few minutes"
+            ), headers)
+
+        self.server.midjourney.start_job(session, payload)
+        self.send_json(204, None, headers)
+
+    def serve_attachment(self, path):
+        """CDN: supporta Range, banda limitata e interruzioni a metà"""
+        with self.server.lock:
+            body = self.server.attachments.get(path)
+        if body is None:
+            return self.send_json(404, {"message": "Not Found"})
+
+        self.server.count("cdn_requests")
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[6:].split("-")[0] or 0)
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.server.count("cdn_ranges")
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        fail_at = None
+        if random.random() < self.server.config.cdn_failure_ratio:
+            fail_at = start + random.randrange(1, max(2, len(body) - start))
+
+        chunk_size = 64 * 1024
+        bandwidth = self.server.config.cdn_bandwidth
+        position = start
+        while position < len(body):
+            end = min(len(body), position + chunk_size)
+            if fail_at is not None and end >= fail_at:
+                self.wfile.write(body[position:fail_at])
+                self.server.count("cdn_bytes", fail_at - position)
+                self.server.count("cdn_failures")
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            self.wfile.write(body[position:end])
+            self.server.count("cdn_bytes", end - position)
+            position = end
+            if bandwidth:
+                time.sleep(chunk_size / bandwidth)
+
+    def upgrade(self, url):
+        """Handshake WebSocket e passaggio della socket al gateway"""
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        query = parse_qs(url.query)
+        compress = query.get("compress", [""])[0] == "zlib-stream"
+        GatewayConnection(self.server, self, compress).run()
+        self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Discord gateway/REST/CDN stand-in")
+    defaults = FakeDiscordConfig()
+    for name, value in vars(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    config = FakeDiscordConfig(**vars(parser.parse_args()))
+
+    server = FakeDiscordServer(config)
+    print(f"Fake Discord listening on {server.http_url} (API: {server.http_url}/api/v9)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.get_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
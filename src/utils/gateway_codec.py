@@ -0,0 +1,56 @@
+import json
+import zlib
+
+# Decoder JSON più veloce se disponibile
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+        JSON_BACKEND = "ujson"
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = "json"
+
+ZLIB_SUFFIX = b"\x00\x00\xff\xff"
+
+
+class GatewayDecoder:
+    def __init__(self, compress=True):
+        """Decodifica i frame del gateway, con supporto a zlib-stream"""
+        self.compress = compress
+        self.buffer = bytearray()
+        self.inflator = zlib.decompressobj()
+
+    def reset(self):
+        """Nuova connessione: il contesto zlib riparte da zero"""
+        self.buffer = bytearray()
+        self.inflator = zlib.decompressobj()
+
+    def inflate(self, message):
+        """Ritorna il payload grezzo o None se il messaggio è incompleto"""
+        if isinstance(message, str):
+            # Frame testuale non compresso
+            return message
+
+        self.buffer.extend(message)
+        if len(message) < 4 or message[-4:] != ZLIB_SUFFIX:
+            return None
+
+        compressed = bytes(self.buffer)
+        self.buffer = bytearray()
+        return self.inflator.decompress(compressed)
+
+    def loads(self, payload):
+        """Decodifica JSON di un payload grezzo"""
+        return json_loads(payload)
+
+    def query_string(self):
+        """Parametri da aggiungere all'URL del gateway"""
+        query = "v=9&encoding=json"
+        if self.compress:
+            query += "&compress=zlib-stream"
+        return query
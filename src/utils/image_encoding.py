@@ -0,0 +1,86 @@
+import io
+import os
+import base64
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Oltre questi limiti Claude ridimensiona comunque l'immagine lato server
+MAX_EDGE = 1568
+MAX_PIXELS = 1_150_000
+
+MEDIA_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif"
+}
+
+
+class ImageEncoder:
+    def __init__(self, app_reference, max_edge=MAX_EDGE, max_pixels=MAX_PIXELS,
+                 jpeg_quality=90, cache_bytes=64 * 1024 * 1024):
+        """Ridimensiona e ricodifica le immagini prima del base64 per l'API di Claude"""
+        self.app = app_reference
+        self.max_edge = max_edge
+        self.max_pixels = max_pixels
+        self.jpeg_quality = jpeg_quality
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()  # (percorso, dimensione, mtime) -> (media_type, base64)
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+
+    def target_size(self, width, height):
+        """Dimensioni entro lato massimo e numero di pixel, mantenendo le proporzioni"""
+        scale = min(1.0, self.max_edge / max(width, height), (self.max_pixels / (width * height)) ** 0.5)
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def encode(self, image_path):
+        """Ritorna (media_type, dati base64) dell'immagine pronta per la richiesta"""
+        stat = os.stat(image_path)
+        cache_key = (image_path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.cache.get(cache_key)
+            if cached:
+                self.cache.move_to_end(cache_key)
+                return cached
+
+        media_type, data = self.prepare(image_path)
+        encoded = (media_type, base64.b64encode(data).decode('utf-8'))
+
+        with self.lock:
+            if cache_key not in self.cache:
+                self.cache[cache_key] = encoded
+                self.cached_bytes += len(encoded[1])
+            while self.cached_bytes > self.cache_bytes and self.cache:
+                _, (_, evicted) = self.cache.popitem(last=False)
+                self.cached_bytes -= len(evicted)
+        return encoded
+
+    def prepare(self, image_path):
+        """Byte da inviare e relativo media_type"""
+        with Image.open(image_path) as image:
+            source_format = image.format
+            size = self.target_size(*image.size)
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+            # Già entro i limiti e in un formato compatto: si inviano i byte originali
+            # (un PNG opaco diventa JPEG, molto più leggero per immagini fotografiche)
+            if size == image.size and source_format in MEDIA_TYPES and (source_format != "PNG" or has_alpha):
+                with open(image_path, 'rb') as f:
+                    return MEDIA_TYPES[source_format], f.read()
+
+            if size != image.size:
+                image = image.resize(size, Image.LANCZOS)
+
+            output = io.BytesIO()
+            if has_alpha:
+                # La trasparenza richiede PNG
+                image.save(output, format="PNG", optimize=True)
+                media_type = "image/png"
+            else:
+                image.convert("RGB").save(output, format="JPEG", quality=self.jpeg_quality, optimize=True)
+                media_type = "image/jpeg"
+
+        return media_type, output.getvalue()
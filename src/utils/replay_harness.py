@@ -0,0 +1,260 @@
+"""Riproduce una registrazione del gateway contro DiscordClient e misura le latenze.
+
+Registrazione: impostare "GATEWAY_RECORD_FILE": "gateway.rec.gz" nel config.
+Replay (dalla cartella src):
+    python -m utils.replay_harness gateway.rec.gz --speed 10
+    python -m utils.replay_harness gateway.rec.gz --speed 0   # massima velocità
+
+Gli allegati sono serviti da una CDN locale: file con lo stesso nome in --store,
+altrimenti byte sintetici della dimensione registrata.
+
+Stadi misurati:
+    dispatch    durata di on_message sul thread del gateway
+    download    on_message -> newImageReceived.emit (download e salvataggio)
+    signal      emit -> slot sul thread Qt (consegna cross-thread)
+    end_to_end  on_message -> slot sul thread Qt
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from urllib.parse import urlsplit
+
+from PyQt5.QtCore import QCoreApplication, QObject, QTimer, pyqtSignal
+
+from MJ import DiscordClient
+from core.heartbeat import LatencyHistogram
+from core.event_bus import EventBus
+from core.gateway_recorder import load_recording
+from utils.fake_discord import FakeDiscordServer, FakeDiscordConfig, MIDJOURNEY_ID
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+REPLAYED_EVENTS = {"MESSAGE_CREATE", "MESSAGE_UPDATE", "INTERACTION_CREATE", "INTERACTION_SUCCESS"}
+
+
+class ReplaySignals(QObject):
+    newImageReceived = pyqtSignal(str, str, str, str, str, dict)
+
+
+class StageEmitter:
+    def __init__(self, harness):
+        """Al posto di app.newImageReceived: annota l'istante e inoltra al segnale Qt"""
+        self.harness = harness
+
+    def emit(self, save_path, sref, category, subcategory, message_id, buttons_data):
+        self.harness.on_emit(save_path, message_id)
+        self.harness.signals.newImageReceived.emit(
+            save_path, sref or "", category or "", subcategory or "", message_id or "", buttons_data
+        )
+
+
+class ReplayApp:
+    def __init__(self, harness, work_dir, api_url, channel_id):
+        """Riferimento all'app minimo per far girare DiscordClient senza finestra"""
+        self.system_dir = os.path.join(work_dir, "system")
+        self.output_dir = os.path.join(work_dir, "output")
+        self.analysis_dir = os.path.join(work_dir, "analysis")
+        for directory in (self.system_dir, self.output_dir, self.analysis_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.config = {"DISCORD_API_URL": api_url, "CHANNEL_ID": channel_id}
+        self.event_bus = EventBus()
+        self.newImageReceived = StageEmitter(harness)
+        self.errors = 0
+        self.verbose = harness.verbose
+
+    def log_message(self, message):
+        if message.startswith("[ERROR]"):
+            self.errors += 1
+        if self.verbose:
+            print(message)
+
+
+class ReplayHarness:
+    def __init__(self, recording, speed=1.0, store_dir=None, channel_id=None, timeout=60, verbose=False):
+        self.recording = recording
+        self.speed = speed  # 0 = massima velocità
+        self.store_dir = store_dir
+        self.channel_id = channel_id
+        self.timeout = timeout
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.started = {}  # message_id -> istante di on_message
+        self.emitted = {}  # percorso -> istante di emit
+        self.delivered = 0
+        self.expected = 0
+        self.stages = {}
+        self.max_lag = 0.0
+        self.feed_time = 0.0
+        self.feed_done = False
+        self.synthetic = b""
+
+    def histogram(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = LatencyHistogram(size=1000000)
+        return self.stages[stage]
+
+    def attachment_body(self, attachment):
+        """Byte dell'allegato: file dallo store o sintetici (unici per id) della dimensione registrata"""
+        filename = attachment.get("filename", "")
+        if self.store_dir:
+            stored = os.path.join(self.store_dir, filename)
+            if os.path.exists(stored):
+                with open(stored, 'rb') as f:
+                    return f.read()
+
+        size = attachment.get("size") or 1024 * 1024
+        if len(self.synthetic) < size:
+            self.synthetic = os.urandom(size)
+        prefix = str(attachment.get("id", filename)).encode()
+        return prefix + self.synthetic[:max(0, size - len(prefix))]
+
+    def prepare(self, server):
+        """Tiene i dispatch da riprodurre e sposta gli allegati sulla CDN locale"""
+        frames = []
+        seen_attachments = set()
+        for offset, payload in load_recording(self.recording):
+            data = json.loads(payload)
+            if data.get("op") != 0 or data.get("t") not in REPLAYED_EVENTS:
+                continue
+
+            message = data["d"]
+            message_id = None
+            for attachment in message.get("attachments") or []:
+                path = urlsplit(attachment["url"]).path
+                server.store_attachment(path, self.attachment_body(attachment))
+                attachment["url"] = attachment["proxy_url"] = f"{server.http_url}{path}"
+
+                if (data["t"] == "MESSAGE_CREATE"
+                        and (message.get("author") or {}).get("id") == MIDJOURNEY_ID
+                        and (not self.channel_id or str(message.get("channel_id")) == str(self.channel_id))
+                        and attachment.get("filename", "").lower().endswith(IMAGE_EXTENSIONS)
+                        and attachment.get("id") not in seen_attachments):
+                    seen_attachments.add(attachment.get("id"))
+                    self.expected += 1
+                    message_id = message.get("id")
+
+            frames.append((offset, json.dumps(data, separators=(",", ":")), message_id))
+        return frames
+
+    def feed(self, client, frames):
+        """Thread del gateway simulato: consegna i frame rispettando gli offset / speed"""
+        dispatch = self.histogram("dispatch")
+        start = time.perf_counter()
+        for offset, payload, message_id in frames:
+            if self.speed:
+                due = start + offset / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+
+            begin = time.perf_counter()
+            if message_id:
+                with self.lock:
+                    self.started[message_id] = begin
+            client.on_message(None, payload)
+            dispatch.record(time.perf_counter() - begin)
+
+        self.feed_time = time.perf_counter() - start
+        self.feed_done = True
+
+    def on_emit(self, save_path, message_id):
+        now = time.perf_counter()
+        with self.lock:
+            self.emitted[save_path] = now
+            begin = self.started.get(message_id)
+        if begin is not None:
+            self.histogram("download").record(now - begin)
+
+    def on_image(self, save_path, sref, category, subcategory, message_id, buttons_data):
+        """Slot sul thread Qt: qui arriverebbe handle_new_image"""
+        now = time.perf_counter()
+        with self.lock:
+            emitted = self.emitted.pop(save_path, None)
+            begin = self.started.get(message_id)
+            self.delivered += 1
+        if emitted is not None:
+            self.histogram("signal").record(now - emitted)
+        if begin is not None:
+            self.histogram("end_to_end").record(now - begin)
+
+    def run(self):
+        application = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+        server = FakeDiscordServer(FakeDiscordConfig(port=0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        work_dir = tempfile.mkdtemp(prefix="mj_replay_")
+        try:
+            frames = self.prepare(server)
+            self.signals = ReplaySignals()
+            self.signals.newImageReceived.connect(self.on_image)
+            app = ReplayApp(self, work_dir, f"{server.http_url}/api/v9", self.channel_id)
+            client = DiscordClient("replay", app)
+            client.event_filter.configure(self.channel_id)
+
+            started_at = time.perf_counter()
+            threading.Thread(target=self.feed, args=(client, frames), daemon=True).start()
+
+            def check():
+                # Nessun widget: gli eventi di stato vengono solo scartati
+                app.event_bus.drain()
+                elapsed = time.perf_counter() - started_at
+                if self.feed_done and (self.delivered >= self.expected or elapsed > self.timeout):
+                    application.quit()
+
+            timer = QTimer()
+            timer.timeout.connect(check)
+            timer.start(20)
+            application.exec_()
+            total_time = time.perf_counter() - started_at
+
+            client.stop()
+            return self.report(frames, total_time, app.errors)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def report(self, frames, total_time, errors):
+        dispatch = self.histogram("dispatch")
+        with dispatch.lock:
+            busy = sum(dispatch.samples)
+        return {
+            "events": len(frames),
+            "images_expected": self.expected,
+            "images_delivered": self.delivered,
+            "errors": errors,
+            "speed": self.speed or "max",
+            "feed_seconds": round(self.feed_time, 3),
+            "total_seconds": round(total_time, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "event_rate": round(len(frames) / self.feed_time, 1) if self.feed_time else None,
+            # Tetto del thread del gateway: eventi/s se on_message fosse l'unico costo
+            "max_sustainable_event_rate": round(len(frames) / busy, 1) if busy else None,
+            "stages_ms": {
+                stage: {key: round(value, 3) for key, value in histogram.summary().items()}
+                for stage, histogram in self.stages.items() if histogram.summary()
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded gateway stream against DiscordClient")
+    parser.add_argument("recording", help="file registrato con GATEWAY_RECORD_FILE")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tempo reale, 10 = 10x, 0 = massima")
+    parser.add_argument("--store", help="cartella con gli allegati originali (per nome file)")
+    parser.add_argument("--channel-id", help="canale monitorato (default: tutti)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    harness = ReplayHarness(args.recording, args.speed, args.store, args.channel_id, args.timeout, args.verbose)
+    print(json.dumps(harness.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()